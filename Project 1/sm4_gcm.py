@@ -1,5 +1,64 @@
+import hashlib
+import os
 import struct
 import random
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import numpy as np
+except ImportError:  # NumPy为可选依赖，缺失时numpy引擎回退到ttable引擎
+    np = None
+
+def _xor_bytes(a, b):
+    """按大整数对两段等长字节串异或"""
+    return (int.from_bytes(a, byteorder='big') ^ int.from_bytes(b, byteorder='big')).to_bytes(
+        len(a), byteorder='big'
+    )
+
+
+# GHASH归约多项式 x^128 + x^7 + x^2 + x + 1 在GCM位序下的表示
+_GHASH_R = 0xE1 << 120
+
+
+def _ghash_reduce_4bit_table():
+    """Shoup 4位算法的归约表：右移4位时移出的半字节r对应的归约值"""
+    table = []
+    for r in range(16):
+        v = r
+        for _ in range(4):
+            v = (v >> 1) ^ _GHASH_R if v & 1 else v >> 1
+        table.append(v)
+    return tuple(table)
+
+
+_GHASH_REDUCE_4BIT = _ghash_reduce_4bit_table()
+
+
+def _gf128_mult(x, y):
+    """GF(2^128)上的逐位乘法（GCM位序），作为查表实现的参照"""
+    z = 0
+    v = y
+    for i in range(127, -1, -1):
+        if (x >> i) & 1:
+            z ^= v
+        v = (v >> 1) ^ _GHASH_R if v & 1 else v >> 1
+    return z
+
+
+def _gf128_pow(h, n):
+    """GF(2^128)上的幂H^n（平方-乘算法），n=0时为单位元"""
+    result = 1 << 127
+    while n:
+        if n & 1:
+            result = _gf128_mult(result, h)
+        h = _gf128_mult(h, h)
+        n >>= 1
+    return result
+
 
 class SM4:
     """SM4分组密码算法实现"""
@@ -36,11 +95,57 @@ class SM4:
         0x10171E25, 0x2C333A41, 0x484F565D, 0x646B7279
     ]
 
-    def __init__(self, key):
+    # 可选的分组加密引擎：basic为逐字节S盒查表的原始实现，ttable为查表合并S盒与L变换的实现，
+    # numpy在批量加密时把N个分组放进uint32数组做向量化轮运算
+    ENGINES = ('basic', 'ttable', 'numpy')
+
+    # numpy引擎批量加密的最小分组数，更小的批次向量化开销大于收益，走ttable路径
+    NUMPY_MIN_BLOCKS = 64
+
+    # T表（由_build_t_tables惰性生成，所有实例共享）
+    _T0 = _T1 = _T2 = _T3 = None
+    _T_arrays = None
+
+    def __init__(self, key, engine='ttable'):
         """初始化SM4加密器/解密器，生成轮密钥"""
+        if engine not in self.ENGINES:
+            raise ValueError(f"不支持的SM4引擎: {engine}")
+        if engine == 'numpy' and np is None:
+            engine = 'ttable'
         self.key = key
+        self.engine = engine
         self.round_keys = self._generate_round_keys()
 
+        if engine in ('ttable', 'numpy'):
+            self._build_t_tables()
+            # 每4轮一组的轮密钥，便于展开轮函数
+            self._round_key_groups = [
+                tuple(self.round_keys[i:i + 4]) for i in range(0, 32, 4)
+            ]
+            self._block_encrypt = self._block_encrypt_ttable
+            self._encrypt_words = self._encrypt_words_ttable
+        else:
+            self._block_encrypt = self._block_encrypt_basic
+            self._encrypt_words = self._encrypt_words_basic
+
+    @classmethod
+    def _build_t_tables(cls):
+        """预计算4张256项T表：T_i[b]为字节b位于第i个字节位置时经S盒与L变换的结果"""
+        if cls._T0 is not None:
+            return
+
+        def l_transform(s):
+            return s ^ ((s << 13 | s >> 19) & 0xFFFFFFFF) ^ ((s << 23 | s >> 9) & 0xFFFFFFFF)
+
+        cls._T0 = tuple(l_transform(cls.Sbox[b] << 24) for b in range(256))
+        cls._T1 = tuple(l_transform(cls.Sbox[b] << 16) for b in range(256))
+        cls._T2 = tuple(l_transform(cls.Sbox[b] << 8) for b in range(256))
+        cls._T3 = tuple(l_transform(cls.Sbox[b]) for b in range(256))
+        if np is not None:
+            cls._T_arrays = tuple(
+                np.array(table, dtype=np.uint32) for table in (cls._T0, cls._T1, cls._T2, cls._T3)
+            )
+
     def _rotate_left(self, x, n):
         """循环左移n位"""
         return ((x << n) & 0xFFFFFFFF) | ((x >> (32 - n)) & 0xFFFFFFFF)
@@ -77,7 +182,7 @@ class SM4:
         
         return round_keys
 
-    def _block_encrypt(self, block):
+    def _block_encrypt_basic(self, block):
         """加密一个128位数据块"""
         # 将输入块拆分为4个32位字
         X = [(block >> (96 - i * 32)) & 0xFFFFFFFF for i in range(4)]
@@ -90,6 +195,75 @@ class SM4:
         cipher_block = (X[35] << 96) | (X[34] << 64) | (X[33] << 32) | X[32]
         return cipher_block
 
+    def _block_encrypt_ttable(self, block):
+        """使用T表加密一个128位数据块（轮函数按4轮展开）"""
+        T0, T1, T2, T3 = self._T0, self._T1, self._T2, self._T3
+        x0 = (block >> 96) & 0xFFFFFFFF
+        x1 = (block >> 64) & 0xFFFFFFFF
+        x2 = (block >> 32) & 0xFFFFFFFF
+        x3 = block & 0xFFFFFFFF
+
+        for k0, k1, k2, k3 in self._round_key_groups:
+            t = x1 ^ x2 ^ x3 ^ k0
+            x0 ^= T0[t >> 24] ^ T1[(t >> 16) & 0xFF] ^ T2[(t >> 8) & 0xFF] ^ T3[t & 0xFF]
+            t = x2 ^ x3 ^ x0 ^ k1
+            x1 ^= T0[t >> 24] ^ T1[(t >> 16) & 0xFF] ^ T2[(t >> 8) & 0xFF] ^ T3[t & 0xFF]
+            t = x3 ^ x0 ^ x1 ^ k2
+            x2 ^= T0[t >> 24] ^ T1[(t >> 16) & 0xFF] ^ T2[(t >> 8) & 0xFF] ^ T3[t & 0xFF]
+            t = x0 ^ x1 ^ x2 ^ k3
+            x3 ^= T0[t >> 24] ^ T1[(t >> 16) & 0xFF] ^ T2[(t >> 8) & 0xFF] ^ T3[t & 0xFF]
+
+        # 反序输出
+        return (x3 << 96) | (x2 << 64) | (x1 << 32) | x0
+
+    def _encrypt_words_basic(self, words):
+        """逐块调用原始实现加密32位字序列（每4个字为一个数据块）"""
+        out = []
+        for i in range(0, len(words), 4):
+            block = (words[i] << 96) | (words[i + 1] << 64) | (words[i + 2] << 32) | words[i + 3]
+            cipher_int = self._block_encrypt_basic(block)
+            out += ((cipher_int >> 96) & 0xFFFFFFFF, (cipher_int >> 64) & 0xFFFFFFFF,
+                    (cipher_int >> 32) & 0xFFFFFFFF, cipher_int & 0xFFFFFFFF)
+        return out
+
+    def _encrypt_words_ttable(self, words):
+        """使用T表加密32位字序列（每4个字为一个数据块），整批在同一循环内完成"""
+        T0, T1, T2, T3 = self._T0, self._T1, self._T2, self._T3
+        round_key_groups = self._round_key_groups
+        out = [0] * len(words)
+
+        for i in range(0, len(words), 4):
+            x0, x1, x2, x3 = words[i:i + 4]
+            for k0, k1, k2, k3 in round_key_groups:
+                t = x1 ^ x2 ^ x3 ^ k0
+                x0 ^= T0[t >> 24] ^ T1[(t >> 16) & 0xFF] ^ T2[(t >> 8) & 0xFF] ^ T3[t & 0xFF]
+                t = x2 ^ x3 ^ x0 ^ k1
+                x1 ^= T0[t >> 24] ^ T1[(t >> 16) & 0xFF] ^ T2[(t >> 8) & 0xFF] ^ T3[t & 0xFF]
+                t = x3 ^ x0 ^ x1 ^ k2
+                x2 ^= T0[t >> 24] ^ T1[(t >> 16) & 0xFF] ^ T2[(t >> 8) & 0xFF] ^ T3[t & 0xFF]
+                t = x0 ^ x1 ^ x2 ^ k3
+                x3 ^= T0[t >> 24] ^ T1[(t >> 16) & 0xFF] ^ T2[(t >> 8) & 0xFF] ^ T3[t & 0xFF]
+            out[i:i + 4] = x3, x2, x1, x0
+
+        return out
+
+    def _encrypt_array_numpy(self, words):
+        """向量化加密形如(N, 4)的uint32数组，每轮对N个分组同时查T表"""
+        T0, T1, T2, T3 = self._T_arrays
+        x0, x1, x2, x3 = (words[:, i].copy() for i in range(4))
+
+        for k0, k1, k2, k3 in self._round_key_groups:
+            t = x1 ^ x2 ^ x3 ^ np.uint32(k0)
+            x0 ^= T0[t >> 24] ^ T1[(t >> 16) & 0xFF] ^ T2[(t >> 8) & 0xFF] ^ T3[t & 0xFF]
+            t = x2 ^ x3 ^ x0 ^ np.uint32(k1)
+            x1 ^= T0[t >> 24] ^ T1[(t >> 16) & 0xFF] ^ T2[(t >> 8) & 0xFF] ^ T3[t & 0xFF]
+            t = x3 ^ x0 ^ x1 ^ np.uint32(k2)
+            x2 ^= T0[t >> 24] ^ T1[(t >> 16) & 0xFF] ^ T2[(t >> 8) & 0xFF] ^ T3[t & 0xFF]
+            t = x0 ^ x1 ^ x2 ^ np.uint32(k3)
+            x3 ^= T0[t >> 24] ^ T1[(t >> 16) & 0xFF] ^ T2[(t >> 8) & 0xFF] ^ T3[t & 0xFF]
+
+        return np.stack((x3, x2, x1, x0), axis=1)
+
     def encrypt_block(self, block):
         """加密一个16字节的数据块"""
         if len(block) != 16:
@@ -101,19 +275,126 @@ class SM4:
         # 转换回字节
         return cipher_int.to_bytes(16, byteorder='big')
 
+    def encrypt_blocks(self, buffer):
+        """批量加密连续存放的N个16字节数据块（bytes/bytearray/memoryview），返回密文字节串"""
+        data = memoryview(buffer).cast('B')
+        if len(data) % 16 != 0:
+            raise ValueError("SM4批量加密的数据长度必须是16字节的整数倍")
+        if self.engine == 'numpy' and len(data) >= 16 * self.NUMPY_MIN_BLOCKS:
+            words = np.frombuffer(data, dtype='>u4').astype(np.uint32).reshape(-1, 4)
+            return self._encrypt_array_numpy(words).astype('>u4').tobytes()
+        # 一次性解包/打包所有32位字，避免逐块转换
+        word_format = f'>{len(data) // 4}I'
+        words = struct.unpack(word_format, data)
+        return struct.pack(word_format, *self._encrypt_words(words))
+
+    def ctr_keystream(self, initial_counter, block_count):
+        """加密连续的计数器值initial_counter, initial_counter+1, ...，返回block_count个分组的密钥流"""
+        if (self.engine == 'numpy' and block_count >= self.NUMPY_MIN_BLOCKS
+                and (initial_counter & 0xFFFFFFFF) + block_count <= 0x100000000):
+            # 低32位不产生进位时，直接在数组中生成全部计数器
+            words = np.empty((block_count, 4), dtype=np.uint32)
+            words[:, 0] = (initial_counter >> 96) & 0xFFFFFFFF
+            words[:, 1] = (initial_counter >> 64) & 0xFFFFFFFF
+            words[:, 2] = (initial_counter >> 32) & 0xFFFFFFFF
+            words[:, 3] = np.arange(block_count, dtype=np.uint64) + (initial_counter & 0xFFFFFFFF)
+            return self._encrypt_array_numpy(words).astype('>u4').tobytes()
+
+        counters = b''.join(
+            (initial_counter + i).to_bytes(16, byteorder='big') for i in range(block_count)
+        )
+        return self.encrypt_blocks(counters)
+
+
+class _KeyMaterialCache:
+    """按密钥指纹缓存与密钥相关的预计算结果，容量有限，按最近最少使用淘汰"""
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, cache_key, factory):
+        """返回cache_key对应的缓存项，未命中时调用factory()生成并加入缓存"""
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None:
+                self._entries.move_to_end(cache_key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        # 在锁外完成耗时的预计算
+        entry = factory()
+        with self._lock:
+            self._entries[cache_key] = entry
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
 
 class SM4GCM:
-    """SM4-GCM认证加密模式实现"""
+    """SM4-GCM认证加密模式实现
+
+    轮密钥、哈希子密钥H和GHASH乘法表只与密钥有关，按密钥指纹缓存在_key_cache中，
+    同一密钥重复构造实例几乎没有开销；nonce既可以在构造时绑定，
+    也可以在每次encrypt_and_tag/decrypt_and_verify时单独传入。
+    """
+
+    # 密钥预计算缓存（所有实例共享）
+    _key_cache = _KeyMaterialCache(maxsize=128)
+
+    # CTR模式每次批量生成密钥流的分组数，限制密钥流缓冲区大小
+    CTR_SEGMENT_BLOCKS = 4096
+
+    # 多进程加密时每个子任务的最少分组数，更小的消息直接在当前进程处理
+    PARALLEL_MIN_SEGMENT_BLOCKS = 4096
+
+    # seal_many/open_many每批处理的记录数
+    BULK_BATCH_SIZE = 256
     
-    def __init__(self, key, nonce=None):
+    # GHASH查表宽度：8为每个字节位置一张256项表（16×256，最快），4为Shoup的16项表加归约表（内存最小）
+    GHASH_TABLE_BITS = (4, 8)
+
+    def __init__(self, key, nonce=None, engine='ttable', ghash_bits=8):
         """初始化SM4-GCM实例"""
-        self.sm4 = SM4(self._key_to_int(key))
+        if ghash_bits not in self.GHASH_TABLE_BITS:
+            raise ValueError(f"GHASH查表宽度必须是4或8: {ghash_bits}")
+        key_int = self._key_to_int(key)
         self.nonce = nonce if nonce is not None else b'\x00' * 12  # 默认12字节nonce
-        self.H = self.sm4.encrypt_block(b'\x00' * 16)  # 哈希子密钥
-        self.J0 = self._compute_j0()  # 初始计数器值
-        
-        # 预计算GHASH的部分乘积，优化认证计算
-        self._precompute_ghash_table()
+        self.ghash_bits = ghash_bits
+
+        # 轮密钥、哈希子密钥和GHASH乘法表按密钥缓存（J0的计算可能用到GHASH，必须先取得乘法表）
+        cache_key = (hashlib.sha256(key).digest(), engine, ghash_bits)
+        self.sm4, self.H, self.ghash_table = self._key_cache.get(
+            cache_key, lambda: self._build_key_material(key_int, engine, ghash_bits)
+        )
+        self._ghash_mult = self._ghash_mult_8bit if ghash_bits == 8 else self._ghash_mult_4bit
+        self.J0 = self._compute_j0(self.nonce)  # 初始计数器值
+
+    @classmethod
+    def _build_key_material(cls, key_int, engine, ghash_bits):
+        """生成与密钥相关的全部预计算：SM4轮密钥、哈希子密钥H、GHASH乘法表"""
+        sm4 = SM4(key_int, engine=engine)
+        H = sm4.encrypt_block(b'\x00' * 16)  # 哈希子密钥
+        return sm4, H, cls._precompute_ghash_table(H, ghash_bits)
+
+    @classmethod
+    def clear_key_cache(cls):
+        """清空密钥预计算缓存"""
+        cls._key_cache.clear()
     
     @staticmethod
     def _key_to_int(key):
@@ -122,131 +403,231 @@ class SM4GCM:
             raise ValueError("SM4密钥必须是16字节")
         return int.from_bytes(key, byteorder='big')
     
-    def _compute_j0(self):
+    def _compute_j0(self, nonce):
         """计算初始计数器值J0"""
-        if len(self.nonce) == 12:
+        if len(nonce) == 12:
             # 对于12字节nonce，按特殊规则计算J0
-            return self.nonce + b'\x00\x00\x00\x01'
+            return nonce + b'\x00\x00\x00\x01'
         else:
-            # 对于其他长度nonce，使用GHASH计算
-            len_bits = len(self.nonce) * 8
-            len_bytes = len_bits.to_bytes(8, byteorder='big')
-            return self.ghash(b'', self.nonce + b'\x00' * ((16 - len(self.nonce) % 16) % 16) + len_bytes)
-    
-    def _precompute_ghash_table(self):
-        """预计算GHASH的乘法表，加速认证计算"""
-        self.ghash_table = []
-        h = int.from_bytes(self.H, byteorder='big')
-        
-        # 预计算每个位的乘法结果 - 修复：将range(8)改为range(16)
-        for i in range(16):
-            row = []
-            current_h = h  # 每次循环使用初始h值，避免上一次循环的修改影响结果
-            for j in range(256):
-                val = 0
-                x = j
-                for k in range(8):
-                    if x & 1:
-                        val ^= current_h
-                    x >>= 1
-                    # 伽罗瓦域乘法的移位操作
-                    if current_h & 0x80000000000000000000000000000000:
-                        current_h = (current_h << 1) ^ 0x87
-                    else:
-                        current_h <<= 1
-                    current_h &= 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF  # 保持128位
-                row.append(val.to_bytes(16, byteorder='big'))
-            self.ghash_table.append(row)
+            # 对于其他长度nonce：J0 = GHASH(nonce || 0填充 || 0^64 || [len(nonce)]_64)
+            hash_val = self._ghash_padded(0, nonce)
+            hash_val = self._ghash_blocks(hash_val, (len(nonce) * 8).to_bytes(16, byteorder='big'))
+            return hash_val.to_bytes(16, byteorder='big')
+
+    def _resolve_j0(self, nonce):
+        """未单独传入nonce时使用构造时绑定的J0"""
+        return self.J0 if nonce is None else self._compute_j0(nonce)
     
+    @staticmethod
+    def _precompute_ghash_table(H, ghash_bits):
+        """预计算GHASH的乘法表，加速认证计算
+
+        分组按GCM约定以大端128位整数表示（最高位为x^0），乘以x即右移一位并按R归约。
+        """
+        h = int.from_bytes(H, byteorder='big')
+
+        # H·x^i，i = 0..127
+        h_powers = []
+        for _ in range(128):
+            h_powers.append(h)
+            h = (h >> 1) ^ _GHASH_R if h & 1 else h >> 1
+
+        if ghash_bits == 8:
+            # table[i][b]：字节b位于第i个字节位置时与H的乘积
+            table = []
+            for i in range(16):
+                row = [0] * 256
+                for b in range(1, 256):
+                    low = b & -b
+                    row[b] = row[b ^ low] ^ h_powers[8 * i + 8 - low.bit_length()]
+                table.append(tuple(row))
+            return tuple(table)
+
+        # table[n]：半字节n位于最高位置时与H的乘积
+        row = [0] * 16
+        for n in range(1, 16):
+            low = n & -n
+            row[n] = row[n ^ low] ^ h_powers[4 - low.bit_length()]
+        return tuple(row)
+
+    def _ghash_mult_8bit(self, x):
+        """x·H：16次按字节位置查表后异或，无需归约"""
+        t = self.ghash_table
+        return (t[0][x >> 120] ^ t[1][(x >> 112) & 0xFF] ^ t[2][(x >> 104) & 0xFF]
+                ^ t[3][(x >> 96) & 0xFF] ^ t[4][(x >> 88) & 0xFF] ^ t[5][(x >> 80) & 0xFF]
+                ^ t[6][(x >> 72) & 0xFF] ^ t[7][(x >> 64) & 0xFF] ^ t[8][(x >> 56) & 0xFF]
+                ^ t[9][(x >> 48) & 0xFF] ^ t[10][(x >> 40) & 0xFF] ^ t[11][(x >> 32) & 0xFF]
+                ^ t[12][(x >> 24) & 0xFF] ^ t[13][(x >> 16) & 0xFF] ^ t[14][(x >> 8) & 0xFF]
+                ^ t[15][x & 0xFF])
+
+    def _ghash_mult_4bit(self, x):
+        """x·H：Shoup 4位算法，从最低半字节开始按Horner法则每步乘x^4并归约"""
+        t = self.ghash_table
+        reduce_4bit = _GHASH_REDUCE_4BIT
+        z = t[x & 0xF]
+        for _ in range(31):
+            x >>= 4
+            z = (z >> 4) ^ reduce_4bit[z & 0xF] ^ t[x & 0xF]
+        return z
+
     def ghash(self, auth_data, ciphertext):
         """优化的GHASH函数实现，用于计算认证标签"""
-        # 组合数据并填充
-        data = auth_data + ciphertext
-        pad_length = (16 - len(data) % 16) % 16
-        data += b'\x00' * pad_length
-        
+        # 关联数据与密文分别补零到16字节整数倍
+        hash_val = self._ghash_padded(0, auth_data)
+        hash_val = self._ghash_padded(hash_val, ciphertext)
+
         # 添加长度信息
-        al = len(auth_data) * 8
-        cl = len(ciphertext) * 8
-        data += al.to_bytes(8, byteorder='big')
-        data += cl.to_bytes(8, byteorder='big')
-        
-        # 初始化哈希值
-        hash_val = b'\x00' * 16
-        
-        # 处理每个16字节块
+        hash_val = self._ghash_blocks(hash_val, self._ghash_length_block(len(auth_data), len(ciphertext)))
+        return hash_val.to_bytes(16, byteorder='big')
+
+    @staticmethod
+    def _ghash_length_block(aad_length, data_length):
+        """长度分组：[len(A)]_64 || [len(C)]_64（比特）"""
+        return (aad_length * 8).to_bytes(8, byteorder='big') + (data_length * 8).to_bytes(8, byteorder='big')
+
+    def _ghash_padded(self, hash_val, data):
+        """吸收data并把末尾不足16字节的部分补零，返回新的哈希值"""
+        data = memoryview(data).cast('B')
+        whole = len(data) - len(data) % 16
+        hash_val = self._ghash_blocks(hash_val, data[:whole])
+        if whole < len(data):
+            hash_val = self._ghash_blocks(hash_val, bytes(data[whole:]).ljust(16, b'\x00'))
+        return hash_val
+
+    def _ghash_blocks(self, hash_val, data):
+        """从哈希值hash_val（128位整数）开始吸收data中的完整16字节块，返回新的哈希值"""
+        mult = self._ghash_mult
+        from_bytes = int.from_bytes
         for i in range(0, len(data), 16):
-            block = data[i:i+16]
-            # 异或当前块与哈希值
-            x = bytes(a ^ b for a, b in zip(hash_val, block))
-            
-            # 使用预计算表加速伽罗瓦乘法
-            y = [0] * 16
-            for j in range(16):
-                y[j] = self.ghash_table[j][x[j]]
-            
-            # 累加结果
-            hash_val = b'\x00' * 16
-            for j in range(16):
-                hash_val = bytes(
-                    (hash_val[k] ^ y[j][k]) for k in range(16)
-                )
-        
+            hash_val = mult(hash_val ^ from_bytes(data[i:i + 16], byteorder='big'))
         return hash_val
     
-    def ctr_encrypt(self, plaintext):
+    def encryptor(self, tag_length=16, nonce=None):
+        """创建流式加密上下文：update_aad() / update() / finalize()"""
+        return SM4GCMContext(self, encrypting=True, tag_length=tag_length, nonce=nonce)
+
+    def decryptor(self, tag_length=16, nonce=None):
+        """创建流式解密上下文：update_aad() / update() / finalize(tag)"""
+        return SM4GCMContext(self, encrypting=False, tag_length=tag_length, nonce=nonce)
+
+    def ctr_encrypt(self, plaintext, nonce=None):
         """CTR模式加密"""
-        ciphertext = b''
-        counter = int.from_bytes(self.J0, byteorder='big')
-        
-        # 处理每个块
-        for i in range(0, len(plaintext), 16):
-            block = plaintext[i:i+16]
-            
-            # 加密计数器值作为密钥流
-            counter_bytes = counter.to_bytes(16, byteorder='big')
-            keystream = self.sm4.encrypt_block(counter_bytes)
-            
-            # 异或得到密文
-            cipher_block = bytes(a ^ b for a, b in zip(block, keystream[:len(block)]))
-            ciphertext += cipher_block
-            
-            # 递增计数器
-            counter += 1
-        
-        return ciphertext
+        ciphertext = bytearray(len(plaintext))
+        initial_counter = int.from_bytes(self._resolve_j0(nonce), byteorder='big')
+        self.ctr_encrypt_into(plaintext, ciphertext, initial_counter)
+        return bytes(ciphertext)
+
+    def ctr_encrypt_into(self, src, dst, initial_counter=None):
+        """CTR模式加密src，结果写入调用方提供的可写缓冲区dst，返回写入的字节数
+
+        initial_counter默认为J0；按CTR_SEGMENT_BLOCKS分段生成密钥流，
+        每段以一个大整数完成异或后直接写入dst，不产生与消息等长的中间副本。
+        """
+        src = memoryview(src).cast('B')
+        out = memoryview(dst).cast('B')
+        if out.readonly:
+            raise TypeError("输出缓冲区必须可写")
+        if len(out) < len(src):
+            raise ValueError("输出缓冲区长度不足")
+
+        counter = int.from_bytes(self.J0, byteorder='big') if initial_counter is None else initial_counter
+        segment_size = 16 * self.CTR_SEGMENT_BLOCKS
+        for start in range(0, len(src), segment_size):
+            chunk = src[start:start + segment_size]
+            block_count = (len(chunk) + 15) // 16
+            keystream = memoryview(self.sm4.ctr_keystream(counter, block_count))[:len(chunk)]
+            counter += block_count
+            out[start:start + len(chunk)] = _xor_bytes(chunk, keystream)
+
+        return len(src)
     
-    def encrypt_and_tag(self, plaintext, auth_data=b'', tag_length=16):
-        """加密并生成认证标签"""
+    def encrypt_and_tag(self, plaintext, auth_data=b'', tag_length=16, nonce=None):
+        """加密并生成认证标签（nonce为None时使用构造时绑定的nonce）"""
         if tag_length not in [4, 8, 12, 13, 14, 15, 16]:
             raise ValueError("标签长度必须是4, 8, 12, 13, 14, 15或16字节")
+        j0 = self._resolve_j0(nonce)
             
         # 加密
-        ciphertext = self.ctr_encrypt(plaintext)
+        ciphertext = self.ctr_encrypt(plaintext, nonce)
         
         # 计算认证标签
         tag = self.ghash(auth_data, ciphertext)
         
         # 用初始计数器加密标签
-        tag_encrypted = self.sm4.encrypt_block(self.J0)
+        tag_encrypted = self.sm4.encrypt_block(j0)
         tag = bytes(a ^ b for a, b in zip(tag, tag_encrypted))
         
         # 返回指定长度的标签
         return ciphertext, tag[:tag_length]
     
-    def decrypt_and_verify(self, ciphertext, tag, auth_data=b'', tag_length=16):
-        """解密并验证认证标签"""
+    def parallel_encrypt_and_tag(self, plaintext, auth_data=b'', workers=None, tag_length=16,
+                                 nonce=None, executor=None):
+        """多进程加密并生成认证标签，结果与encrypt_and_tag完全相同
+
+        明文按分组边界切成若干段，每段在子进程中用各自的起始计数器做CTR加密，
+        并从零开始计算该段密文的GHASH部分和P_k。由于GHASH是H的多项式，
+        最终哈希值为 GHASH(A)·H^m ⊕ Σ P_k·H^(m-e_k)，其中m为密文分组数、e_k为第k段的结束分组。
+        executor可传入复用的ProcessPoolExecutor，否则按workers临时创建。
+        """
+        if tag_length not in [4, 8, 12, 13, 14, 15, 16]:
+            raise ValueError("标签长度必须是4, 8, 12, 13, 14, 15或16字节")
+        workers = workers or os.cpu_count() or 1
+        total_blocks = (len(plaintext) + 15) // 16
+        segment_blocks = max(self.PARALLEL_MIN_SEGMENT_BLOCKS, -(-total_blocks // workers))
+        if total_blocks <= segment_blocks:
+            return self.encrypt_and_tag(plaintext, auth_data, tag_length, nonce)
+
+        j0 = self._resolve_j0(nonce)
+        counter = int.from_bytes(j0, byteorder='big')
+        key = self.sm4.key.to_bytes(16, byteorder='big')
+        data = memoryview(plaintext).cast('B')
+        segment_ends = list(range(segment_blocks, total_blocks, segment_blocks)) + [total_blocks]
+
+        own_executor = executor is None
+        if own_executor:
+            executor = ProcessPoolExecutor(max_workers=min(workers, len(segment_ends)))
+        try:
+            futures = []
+            start = 0
+            for end in segment_ends:
+                futures.append(executor.submit(
+                    _parallel_segment_worker, key, self.sm4.engine, self.ghash_bits,
+                    counter + start, bytes(data[start * 16:end * 16])
+                ))
+                start = end
+
+            # 子进程运行期间在当前进程吸收关联数据
+            h = int.from_bytes(self.H, byteorder='big')
+            hash_val = _gf128_mult(self._ghash_padded(0, auth_data), _gf128_pow(h, total_blocks))
+
+            chunks = []
+            for future, end in zip(futures, segment_ends):
+                chunk, partial = future.result()
+                chunks.append(chunk)
+                hash_val ^= _gf128_mult(partial, _gf128_pow(h, total_blocks - end))
+        finally:
+            if own_executor:
+                executor.shutdown()
+
+        ciphertext = b''.join(chunks)
+        hash_val = self._ghash_blocks(hash_val, self._ghash_length_block(len(auth_data), len(ciphertext)))
+        tag_encrypted = self.sm4.encrypt_block(j0)
+        return ciphertext, _xor_bytes(hash_val.to_bytes(16, byteorder='big'), tag_encrypted)[:tag_length]
+
+    def decrypt_and_verify(self, ciphertext, tag, auth_data=b'', tag_length=16, nonce=None):
+        """解密并验证认证标签（nonce为None时使用构造时绑定的nonce）"""
         if len(tag) != tag_length:
             raise ValueError("标签长度不匹配")
+        j0 = self._resolve_j0(nonce)
             
         # 解密
-        plaintext = self.ctr_encrypt(ciphertext)  # CTR模式解密与加密相同
+        plaintext = self.ctr_encrypt(ciphertext, nonce)  # CTR模式解密与加密相同
         
         # 计算认证标签
         computed_tag = self.ghash(auth_data, ciphertext)
         
         # 用初始计数器加密计算的标签
-        tag_encrypted = self.sm4.encrypt_block(self.J0)
+        tag_encrypted = self.sm4.encrypt_block(j0)
         computed_tag = bytes(a ^ b for a, b in zip(computed_tag, tag_encrypted))
         
         # 验证标签（使用常数时间比较防止侧信道攻击）
@@ -255,6 +636,80 @@ class SM4GCM:
         else:
             raise ValueError("认证失败：标签不匹配")
     
+    def _bulk_keystreams(self, nonces_and_lengths):
+        """为一批记录一次性生成密钥流，返回[(J0, 密钥流)]
+
+        每条记录的计数器从J0开始，密钥流的第一个分组E(J0)同时就是标签掩码，
+        所以至少生成一个分组；整批计数器合并后只调用一次批量加密。
+        """
+        j0s = []
+        counters = []
+        for nonce, length in nonces_and_lengths:
+            j0 = self._compute_j0(nonce)
+            counter = int.from_bytes(j0, byteorder='big')
+            block_count = max(1, (length + 15) // 16)
+            j0s.append((j0, block_count))
+            counters.extend((counter + i).to_bytes(16, byteorder='big') for i in range(block_count))
+
+        keystream = memoryview(self.sm4.encrypt_blocks(b''.join(counters)))
+        result = []
+        offset = 0
+        for j0, block_count in j0s:
+            result.append((j0, keystream[offset:offset + 16 * block_count]))
+            offset += 16 * block_count
+        return result
+
+    def seal_many(self, records, tag_length=16):
+        """批量加密同一密钥下的多条短消息
+
+        records为(nonce, auth_data, plaintext)的可迭代对象，按输入顺序逐条产出(ciphertext, tag)。
+        每BULK_BATCH_SIZE条记录合并计算J0、密钥流和标签掩码，复用按密钥缓存的预计算。
+        """
+        if tag_length not in [4, 8, 12, 13, 14, 15, 16]:
+            raise ValueError("标签长度必须是4, 8, 12, 13, 14, 15或16字节")
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) >= self.BULK_BATCH_SIZE:
+                yield from self._seal_batch(batch, tag_length)
+                batch = []
+        if batch:
+            yield from self._seal_batch(batch, tag_length)
+
+    def _seal_batch(self, batch, tag_length):
+        keystreams = self._bulk_keystreams((nonce, len(plaintext)) for nonce, _, plaintext in batch)
+        for (_, auth_data, plaintext), (_, keystream) in zip(batch, keystreams):
+            ciphertext = _xor_bytes(plaintext, keystream[:len(plaintext)])
+            tag = _xor_bytes(self.ghash(auth_data, ciphertext), keystream[:16])
+            yield ciphertext, tag[:tag_length]
+
+    def open_many(self, records, tag_length=16):
+        """批量解密并验证seal_many产生的记录
+
+        records为(nonce, auth_data, ciphertext, tag)的可迭代对象，按输入顺序逐条产出明文；
+        任一记录验证失败时抛出ValueError，并指明记录序号。
+        """
+        batch = []
+        index = 0
+        for record in records:
+            batch.append(record)
+            if len(batch) >= self.BULK_BATCH_SIZE:
+                yield from self._open_batch(batch, tag_length, index)
+                index += len(batch)
+                batch = []
+        if batch:
+            yield from self._open_batch(batch, tag_length, index)
+
+    def _open_batch(self, batch, tag_length, first_index):
+        keystreams = self._bulk_keystreams((nonce, len(ciphertext)) for nonce, _, ciphertext, _ in batch)
+        for i, ((_, auth_data, ciphertext, tag), (_, keystream)) in enumerate(zip(batch, keystreams)):
+            if len(tag) != tag_length:
+                raise ValueError(f"第{first_index + i}条记录标签长度不匹配")
+            computed_tag = _xor_bytes(self.ghash(auth_data, ciphertext), keystream[:16])
+            if not self._constant_time_compare(tag, computed_tag[:tag_length]):
+                raise ValueError(f"第{first_index + i}条记录认证失败：标签不匹配")
+            yield _xor_bytes(ciphertext, keystream[:len(ciphertext)])
+
     @staticmethod
     def _constant_time_compare(a, b):
         """常数时间比较，防止侧信道攻击"""
@@ -266,8 +721,221 @@ class SM4GCM:
         return result == 0
 
 
+def _parallel_segment_worker(key, engine, ghash_bits, initial_counter, segment):
+    """parallel_encrypt_and_tag的子进程任务：加密一段明文并返回(密文, 该段GHASH部分和)"""
+    gcm = SM4GCM(key, engine=engine, ghash_bits=ghash_bits)
+    ciphertext = bytearray(len(segment))
+    gcm.ctr_encrypt_into(segment, ciphertext, initial_counter)
+    return bytes(ciphertext), gcm._ghash_padded(0, ciphertext)
+
+
+class SM4GCMContext:
+    """SM4-GCM流式加解密上下文
+
+    在多次update调用之间保存GHASH状态、计数器和未用完的密钥流，
+    内存占用只与单次传入的数据块大小有关，与消息总长度无关。
+    """
+
+    def __init__(self, gcm, encrypting=True, tag_length=16, nonce=None):
+        if tag_length not in [4, 8, 12, 13, 14, 15, 16]:
+            raise ValueError("标签长度必须是4, 8, 12, 13, 14, 15或16字节")
+        self._gcm = gcm
+        self._encrypting = encrypting
+        self._tag_length = tag_length
+        self._j0 = gcm._resolve_j0(nonce)
+        self._counter = int.from_bytes(self._j0, byteorder='big')
+        self._keystream = b''  # 上一次update剩余的密钥流
+        self._hash_val = 0
+        self._ghash_buffer = bytearray()  # 不足16字节、尚未吸收进GHASH的数据
+        self._aad_length = 0
+        self._data_length = 0
+        self._data_started = False
+        self._finalized = False
+
+    def _check_active(self):
+        if self._finalized:
+            raise ValueError("流式上下文已经结束")
+
+    def _absorb(self, data):
+        """把数据送入GHASH，只缓存末尾不足一个分组的部分"""
+        data = memoryview(data)
+        if self._ghash_buffer:
+            take = min(16 - len(self._ghash_buffer), len(data))
+            self._ghash_buffer += data[:take]
+            data = data[take:]
+            if len(self._ghash_buffer) < 16:
+                return
+            self._hash_val = self._gcm._ghash_blocks(self._hash_val, bytes(self._ghash_buffer))
+            self._ghash_buffer.clear()
+
+        whole = len(data) - len(data) % 16
+        if whole:
+            self._hash_val = self._gcm._ghash_blocks(self._hash_val, data[:whole])
+        self._ghash_buffer += data[whole:]
+
+    def _flush_ghash_buffer(self):
+        """把缓存中不足一个分组的数据补零后吸收进GHASH"""
+        if self._ghash_buffer:
+            self._hash_val = self._gcm._ghash_padded(self._hash_val, self._ghash_buffer)
+            self._ghash_buffer.clear()
+
+    def update_aad(self, auth_data):
+        """追加关联数据，必须在第一次update之前调用"""
+        self._check_active()
+        if self._data_started:
+            raise ValueError("关联数据必须在加解密数据之前提供")
+        self._aad_length += len(auth_data)
+        self._absorb(auth_data)
+
+    def update(self, data):
+        """加密（或解密）一段数据，返回等长的输出"""
+        self._check_active()
+        if not self._data_started:
+            # 关联数据结束，补零到完整分组
+            self._data_started = True
+            self._flush_ghash_buffer()
+        if not data:
+            return b''
+
+        data = memoryview(data).cast('B')
+        output = bytearray(len(data))
+        out = memoryview(output)
+        pos = 0
+
+        # 先用完上一次剩余的密钥流
+        if self._keystream:
+            pos = min(len(self._keystream), len(data))
+            out[:pos] = _xor_bytes(data[:pos], self._keystream[:pos])
+            self._keystream = self._keystream[pos:]
+
+        # 完整分组直接写入输出缓冲区
+        whole = (len(data) - pos) // 16 * 16
+        if whole:
+            self._gcm.ctr_encrypt_into(data[pos:pos + whole], out[pos:pos + whole], self._counter)
+            self._counter += whole // 16
+            pos += whole
+
+        # 末尾不足一个分组的部分，保留多余的密钥流给下一次update
+        if pos < len(data):
+            keystream = self._gcm.sm4.ctr_keystream(self._counter, 1)
+            self._counter += 1
+            tail = len(data) - pos
+            out[pos:] = _xor_bytes(data[pos:], keystream[:tail])
+            self._keystream = keystream[tail:]
+
+        output = bytes(output)
+        self._data_length += len(data)
+        self._absorb(output if self._encrypting else data)
+        return output
+
+    def _compute_tag(self):
+        self._finalized = True
+        self._flush_ghash_buffer()
+        hash_val = self._gcm._ghash_blocks(
+            self._hash_val, SM4GCM._ghash_length_block(self._aad_length, self._data_length)
+        )
+
+        tag_encrypted = self._gcm.sm4.encrypt_block(self._j0)
+        return _xor_bytes(hash_val.to_bytes(16, byteorder='big'), tag_encrypted)[:self._tag_length]
+
+    def finalize(self, tag=None):
+        """结束流式处理：加密时返回认证标签；解密时验证传入的标签，失败抛出ValueError
+
+        注意：解密时update已经返回了明文，调用方必须在finalize验证通过后才能使用这些明文。
+        """
+        self._check_active()
+        computed_tag = self._compute_tag()
+        if self._encrypting:
+            return computed_tag
+        if tag is None or len(tag) != self._tag_length:
+            raise ValueError("标签长度不匹配")
+        if not SM4GCM._constant_time_compare(tag, computed_tag):
+            raise ValueError("认证失败：标签不匹配")
+        return b''
+
+
+def benchmark_sm4_engines(total_bytes=1024 * 1024, engines=SM4.ENGINES, key=None):
+    """测量各SM4分组加密引擎的吞吐量，返回{引擎: blocks/sec}"""
+    if key is None:
+        key = random.getrandbits(128)
+    block_count = max(1, total_bytes // 16)
+    data = bytes(random.getrandbits(8) for _ in range(block_count * 16))
+    results = {}
+    for engine in engines:
+        sm4 = SM4(key, engine=engine)
+        start = time.perf_counter()
+        sm4.encrypt_blocks(data)
+        elapsed = time.perf_counter() - start
+        results[engine] = block_count / elapsed
+    return results
+
+
+def benchmark_ghash(total_bytes=256 * 1024, key=None):
+    """比较GHASH各实现的吞吐量，返回{实现: MB/s}
+
+    4bit/8bit为查表实现，bitwise为逐位乘法的参照实现。
+    """
+    if key is None:
+        key = bytes(random.getrandbits(8) for _ in range(16))
+    data = bytes(random.getrandbits(8) for _ in range(total_bytes))
+    results = {}
+    for bits in SM4GCM.GHASH_TABLE_BITS:
+        gcm = SM4GCM(key, ghash_bits=bits)
+        start = time.perf_counter()
+        gcm.ghash(b'', data)
+        results[f'{bits}bit'] = total_bytes / (time.perf_counter() - start) / (1024 * 1024)
+
+    h = int.from_bytes(gcm.H, byteorder='big')
+    reference_bytes = min(total_bytes, 16 * 1024)
+    start = time.perf_counter()
+    hash_val = 0
+    for i in range(0, reference_bytes, 16):
+        hash_val = _gf128_mult(hash_val ^ int.from_bytes(data[i:i + 16], byteorder='big'), h)
+    results['bitwise'] = reference_bytes / (time.perf_counter() - start) / (1024 * 1024)
+    return results
+
+
+def benchmark_seal_many(record_count=2000, record_size=256, key=None, engine='ttable'):
+    """比较逐条调用encrypt_and_tag与seal_many的每秒处理记录数"""
+    if key is None:
+        key = bytes(random.getrandbits(8) for _ in range(16))
+    records = [
+        (i.to_bytes(12, byteorder='big'), b'header', bytes(random.getrandbits(8) for _ in range(record_size)))
+        for i in range(record_count)
+    ]
+    gcm = SM4GCM(key, engine=engine)
+
+    start = time.perf_counter()
+    looped = [gcm.encrypt_and_tag(plaintext, auth_data, nonce=nonce) for nonce, auth_data, plaintext in records]
+    loop_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    sealed = list(gcm.seal_many(records))
+    bulk_elapsed = time.perf_counter() - start
+
+    if looped != sealed:
+        raise AssertionError("seal_many结果与encrypt_and_tag不一致")
+    return {'encrypt_and_tag': record_count / loop_elapsed, 'seal_many': record_count / bulk_elapsed}
+
+
 # 示例用法
 if __name__ == "__main__":
+    if '--bench' in sys.argv:
+        # 用法: python sm4_gcm.py --bench [MB]
+        index = sys.argv.index('--bench')
+        size_mb = float(sys.argv[index + 1]) if len(sys.argv) > index + 1 else 1
+        total_bytes = int(size_mb * 1024 * 1024)
+        print(f"SM4引擎吞吐量测试（{total_bytes}字节）:")
+        for engine, rate in benchmark_sm4_engines(total_bytes).items():
+            print(f"{engine}: {rate:,.0f} blocks/sec ({rate * 16 / 1024 / 1024:.2f} MB/s)")
+        print("GHASH吞吐量测试:")
+        for name, rate in benchmark_ghash(min(total_bytes, 1024 * 1024)).items():
+            print(f"{name}: {rate:.2f} MB/s")
+        print("批量AEAD测试（256字节记录）:")
+        for name, rate in benchmark_seal_many().items():
+            print(f"{name}: {rate:,.0f} records/sec")
+        sys.exit(0)
+
     # 生成随机密钥和nonce
     def generate_random_bytes(length):
         """生成指定长度的随机字节"""
@@ -0,0 +1,214 @@
+"""SM4-GCM性能基准测试
+
+覆盖16B到64MB的负载、关联数据较大的场景、密钥初始化开销，以及单独的GHASH和CTR。
+结果以JSON输出（MB/s、ns/block），并可与保存的基线文件比较，超出阈值即返回非零退出码。
+
+用法示例：
+    python sm4_gcm_bench.py --output results.json
+    python sm4_gcm_bench.py --full --save-baseline baseline.json
+    python sm4_gcm_bench.py --baseline baseline.json --tolerance 0.15
+"""
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+
+from sm4_gcm import SM4, SM4GCM, np
+
+# 默认负载大小（纯Python实现下能在合理时间内跑完）
+DEFAULT_SIZES = [16, 256, 4 * 1024, 64 * 1024, 1024 * 1024]
+# --full时的负载大小，最大64MB
+FULL_SIZES = DEFAULT_SIZES + [16 * 1024 * 1024, 64 * 1024 * 1024]
+# 关联数据较大的场景：(明文长度, 关联数据长度)
+AAD_HEAVY_CASES = [(16, 4 * 1024), (16, 64 * 1024), (1024, 256 * 1024)]
+
+SEED = 20240601
+
+
+def parse_size(text):
+    """解析形如16、4K、64M的大小"""
+    text = text.strip().upper()
+    units = {'K': 1024, 'M': 1024 * 1024}
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def measure(func, min_time=0.2, repeat=3):
+    """返回func单次调用的最短耗时（秒）
+
+    先估算使单轮耗时不少于min_time的循环次数，再重复repeat轮取最好成绩。
+    """
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or loops >= 1 << 20:
+            break
+        loops *= 2 if elapsed == 0 else max(2, int(min_time / elapsed) + 1)
+
+    best = elapsed / loops
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        best = min(best, (time.perf_counter() - start) / loops)
+    return best
+
+
+def make_result(name, seconds, processed_bytes=None, **params):
+    """构造一条结果：吞吐量类用例给出MB/s和ns/block，其余给出ns/op"""
+    result = {'name': name, 'seconds': seconds}
+    result.update(params)
+    if processed_bytes:
+        result['bytes'] = processed_bytes
+        result['mb_per_s'] = processed_bytes / seconds / (1024 * 1024)
+        result['ns_per_block'] = seconds * 1e9 / max(1, (processed_bytes + 15) // 16)
+    else:
+        result['ns_per_op'] = seconds * 1e9
+    return result
+
+
+def run_suite(sizes=DEFAULT_SIZES, engines=None, ghash_bits=SM4GCM.GHASH_TABLE_BITS,
+              aad_cases=AAD_HEAVY_CASES, min_time=0.2, repeat=3, log=None):
+    """运行全部基准用例，返回结果列表"""
+    if engines is None:
+        engines = ['ttable', 'numpy'] if np is not None else ['ttable']
+    rng = random.Random(SEED)
+    key = bytes(rng.getrandbits(8) for _ in range(16))
+    nonce = bytes(rng.getrandbits(8) for _ in range(12))
+    payloads = {size: rng.randbytes(size) for size in set(sizes) | {p for p, _ in aad_cases}}
+    results = []
+
+    def record(result):
+        results.append(result)
+        if log:
+            log(result)
+
+    # 密钥初始化开销：清空缓存后的完整预计算，以及命中缓存时的构造
+    for engine in engines:
+        for bits in ghash_bits:
+            def uncached_setup():
+                SM4GCM.clear_key_cache()
+                SM4GCM(key, nonce, engine=engine, ghash_bits=bits)
+
+            record(make_result(f'key_setup/uncached/{engine}/{bits}bit',
+                               measure(uncached_setup, min_time, repeat), engine=engine, ghash_bits=bits))
+            SM4GCM(key, nonce, engine=engine, ghash_bits=bits)
+            record(make_result(f'key_setup/cached/{engine}/{bits}bit',
+                               measure(lambda: SM4GCM(key, nonce, engine=engine, ghash_bits=bits),
+                                       min_time, repeat), engine=engine, ghash_bits=bits))
+
+    for size in sizes:
+        payload = payloads[size]
+
+        # 仅CTR
+        for engine in engines:
+            gcm = SM4GCM(key, nonce, engine=engine)
+            record(make_result(f'ctr/{engine}/{size}', measure(lambda: gcm.ctr_encrypt(payload), min_time, repeat),
+                               size, engine=engine))
+
+        # 仅GHASH
+        for bits in ghash_bits:
+            gcm = SM4GCM(key, nonce, ghash_bits=bits)
+            record(make_result(f'ghash/{bits}bit/{size}', measure(lambda: gcm.ghash(b'', payload), min_time, repeat),
+                               size, ghash_bits=bits))
+
+        # 完整的加密+认证
+        for engine in engines:
+            gcm = SM4GCM(key, nonce, engine=engine)
+            record(make_result(f'encrypt_and_tag/{engine}/{size}',
+                               measure(lambda: gcm.encrypt_and_tag(payload, b'header'), min_time, repeat),
+                               size, engine=engine))
+
+    # 关联数据较大的场景，吞吐量按明文与关联数据总长度计算
+    gcm = SM4GCM(key, nonce)
+    for size, aad_size in aad_cases:
+        payload = payloads[size]
+        auth_data = rng.randbytes(aad_size)
+        record(make_result(f'aad_heavy/{size}+{aad_size}',
+                           measure(lambda: gcm.encrypt_and_tag(payload, auth_data), min_time, repeat),
+                           size + aad_size, aad_bytes=aad_size))
+
+    return results
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    """与基线比较单次耗时，返回超出(1 + tolerance)倍的用例列表[(名称, 基线耗时, 当前耗时)]"""
+    baseline_seconds = {item['name']: item['seconds'] for item in baseline['results']}
+    regressions = []
+    for item in results:
+        reference = baseline_seconds.get(item['name'])
+        if reference is not None and item['seconds'] > reference * (1 + tolerance):
+            regressions.append((item['name'], reference, item['seconds']))
+    return regressions
+
+
+def environment_info():
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'numpy': np.__version__ if np is not None else None,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def format_result(result):
+    if 'mb_per_s' in result:
+        return f"{result['name']:<40} {result['mb_per_s']:>10.3f} MB/s {result['ns_per_block']:>12.0f} ns/block"
+    return f"{result['name']:<40} {result['ns_per_op']:>12.0f} ns/op"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SM4-GCM性能基准测试")
+    parser.add_argument('--sizes', help="逗号分隔的负载大小，如16,4K,1M")
+    parser.add_argument('--full', action='store_true', help="包含16MB和64MB负载")
+    parser.add_argument('--engines', help=f"逗号分隔的SM4引擎，可选{','.join(SM4.ENGINES)}")
+    parser.add_argument('--min-time', type=float, default=0.2, help="每轮最少计时秒数")
+    parser.add_argument('--repeat', type=int, default=3, help="重复轮数，取最好成绩")
+    parser.add_argument('--output', help="结果JSON写入的文件，默认输出到标准输出")
+    parser.add_argument('--save-baseline', help="把本次结果保存为基线文件")
+    parser.add_argument('--baseline', help="与该基线文件比较")
+    parser.add_argument('--tolerance', type=float, default=0.10, help="允许的相对变慢比例")
+    args = parser.parse_args(argv)
+
+    if args.sizes:
+        sizes = [parse_size(item) for item in args.sizes.split(',')]
+    else:
+        sizes = FULL_SIZES if args.full else DEFAULT_SIZES
+    engines = args.engines.split(',') if args.engines else None
+
+    results = run_suite(sizes, engines, min_time=args.min_time, repeat=args.repeat,
+                        log=lambda result: print(format_result(result), file=sys.stderr))
+    report = {'environment': environment_info(), 'results': results}
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(results, baseline, args.tolerance)
+        for name, reference, current in regressions:
+            print(f"性能回退: {name} {reference * 1e6:.1f}us -> {current * 1e6:.1f}us "
+                  f"({current / reference - 1:+.1%})", file=sys.stderr)
+        if regressions:
+            return 1
+        print(f"与基线相比无超过{args.tolerance:.0%}的回退", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,635 @@
+import atexit
+import contextlib
+import csv
+import functools
+import json
 import os
 import random
-from PIL import Image, ImageDraw, ImageFont, ImageEnhance
+import struct
+import sys
+import threading
+import time
+import tracemalloc
+import warnings
+import zlib
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont, ImageEnhance, ImageFilter
 import math
 
+class ImageLRUCache:
+    """按最近最少使用淘汰的图像缓存，缓存图像的像素总字节数不超过max_bytes"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def image_bytes(image):
+        width, height = image.size
+        return width * height * len(image.getbands())
+
+    def get(self, key):
+        with self._lock:
+            image = self._entries.get(key)
+            if image is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return image
+
+    def put(self, key, image):
+        size = self.image_bytes(image)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= self.image_bytes(old)
+            self._entries[key] = image
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= self.image_bytes(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+@functools.lru_cache(maxsize=32)
+def _load_font(font_path, font_size):
+    """加载字体（支持自定义字体路径），失败时回退到系统默认字体"""
+    try:
+        if font_path:
+            # 使用指定的字体文件
+            return ImageFont.truetype(font_path, font_size)
+        # 使用默认字体
+        return ImageFont.truetype("arial.ttf", font_size)
+    except Exception:
+        #  fallback到系统默认字体
+        return ImageFont.load_default()
+
+
+# 水印布局：字体、字号、单个文本的尺寸，以及每个文本图块的(x, y, 旋转角度)
+WatermarkLayout = namedtuple('WatermarkLayout', ['font', 'font_size', 'text_width', 'text_height', 'placements'])
+
+
+# 对齐检测的结果：得分、对水印施加的翻转/旋转、裁剪比例、放大后水印中与图像左上角对齐的偏移，
+# 以及搜索阶段的归一化相关值（未加水印的图像上明显更低，可作为盲检测的统计量）
+WatermarkAlignment = namedtuple('WatermarkAlignment', ['score', 'transform', 'scale', 'offset', 'correlation'])
+
+# 对齐检测尝试的翻转/旋转（与apply_transformations中的变换同名），None表示不变换
+ALIGNMENT_TRANSPOSES = OrderedDict([
+    ('identity', None),
+    ('flip_horizontal', Image.FLIP_LEFT_RIGHT),
+    ('flip_vertical', Image.FLIP_TOP_BOTTOM),
+    ('rotate_90', Image.ROTATE_90),
+    ('rotate_180', Image.ROTATE_180),
+    ('rotate_270', Image.ROTATE_270),
+    ('transpose', Image.TRANSPOSE),
+    ('transverse', Image.TRANSVERSE),
+])
+
+# 交换宽高的翻转/旋转
+_AXIS_SWAPPING_TRANSPOSES = {Image.ROTATE_90, Image.ROTATE_270, Image.TRANSPOSE, Image.TRANSVERSE}
+
+# 对齐检测尝试的裁剪比例
+ALIGNMENT_SCALES = (1.0, 0.95, 0.9, 0.8, 0.7, 0.6)
+
+
+def _fast_fft_length(n):
+    """不小于n且只含因子2、3、5的长度，FFT在这类长度上最快"""
+    while True:
+        m = n
+        for p in (2, 3, 5):
+            while m % p == 0:
+                m //= p
+        if m == 1:
+            return n
+        n += 1
+
+
+def _best_alignment(mask, field, field_spectra=None):
+    """用FFT互相关求field在mask中所有完整重叠偏移上的相关值
+
+    field已减去均值，相关值除以窗口内掩码总量的平方根作归一化，
+    返回(最大归一化相关值, (x偏移, y偏移))。field_spectra按FFT尺寸缓存field的频谱，供多次调用复用。
+    """
+    height, width = field.shape
+    # 补零到便于FFT的尺寸；不小于mask即可保证完整重叠的偏移不发生循环卷绕
+    shape = (_fast_fft_length(mask.shape[0]), _fast_fft_length(mask.shape[1]))
+    field_spectrum = None if field_spectra is None else field_spectra.get(shape)
+    if field_spectrum is None:
+        field_spectrum = np.conj(np.fft.rfft2(field, s=shape))
+        if field_spectra is not None:
+            field_spectra[shape] = field_spectrum
+    corr = np.fft.irfft2(np.fft.rfft2(mask, s=shape) * field_spectrum, s=shape)
+    corr = corr[:mask.shape[0] - height + 1, :mask.shape[1] - width + 1]
+    # 积分图求每个偏移下窗口内的掩码总量
+    integral = np.zeros((mask.shape[0] + 1, mask.shape[1] + 1))
+    integral[1:, 1:] = mask.cumsum(0).cumsum(1)
+    counts = (integral[height:, width:] - integral[:-height, width:]
+              - integral[height:, :-width] + integral[:-height, :-width])
+    strength = corr / np.sqrt(np.maximum(counts, 1e-9))
+    y, x = np.unravel_index(int(np.argmax(strength)), strength.shape)
+    return float(strength[y, x]), (int(x), int(y))
+
+
+# 每个字节值中置位的比特数，用于统计打包掩码中的像素数
+_POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+
+def _popcount(packed):
+    """打包比特数组中置位的总数"""
+    if hasattr(np, 'bitwise_count'):
+        return int(np.bitwise_count(packed).sum(dtype=np.int64))
+    return int(_POPCOUNT[packed].sum(dtype=np.int64))
+
+
+class PackedMask:
+    """按行打包的1比特水印掩码（numpy.packbits，高位在前，每行补齐到整字节）
+
+    检测只需要水印覆盖了哪些像素，用它代替整幅RGBA水印图像可把每像素4字节降为1比特。
+    存储格式是二进制PBM（P4），其数据布局与packbits完全一致，load时直接内存映射文件。
+    """
+
+    def __init__(self, bits, size):
+        self.bits = bits
+        self.size = size
+
+    @classmethod
+    def from_alpha(cls, alpha):
+        """由alpha通道（或灰度）图像构造，非零像素为水印像素"""
+        return cls(np.packbits(np.asarray(alpha) > 0, axis=1), alpha.size)
+
+    @classmethod
+    def from_image(cls, watermark):
+        """由水印图像构造：RGBA/LA取alpha通道，其余模式转为灰度"""
+        if watermark.mode in ('RGBA', 'LA'):
+            return cls.from_alpha(watermark.getchannel('A'))
+        return cls.from_alpha(watermark if watermark.mode in ('1', 'L') else watermark.convert('L'))
+
+    @classmethod
+    def load(cls, path):
+        """内存映射读取save写出的PBM文件，不把掩码数据读入内存"""
+        with open(path, 'rb') as f:
+            tokens = []
+            while len(tokens) < 3:
+                line = f.readline()
+                if not line:
+                    raise ValueError(f"PBM文件头不完整: {path}")
+                tokens += line.split(b'#', 1)[0].split()
+            if tokens[0] != b'P4':
+                raise ValueError(f"不是二进制PBM文件: {path}")
+            offset = f.tell()
+        width, height = int(tokens[1]), int(tokens[2])
+        bits = np.memmap(path, dtype=np.uint8, mode='r', offset=offset, shape=(height, (width + 7) // 8))
+        return cls(bits, (width, height))
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(f"P4\n{self.size[0]} {self.size[1]}\n".encode('ascii'))
+            f.write(np.ascontiguousarray(self.bits).tobytes())
+
+    def count(self):
+        """水印像素数"""
+        return _popcount(self.bits)
+
+    def to_image(self):
+        """转为'L'模式图像（水印像素为255）"""
+        return Image.frombytes('1', self.size, np.ascontiguousarray(self.bits).tobytes()).convert('L')
+
+    def resize(self, size):
+        return PackedMask.from_alpha(self.to_image().resize(size))
+
+    @property
+    def nbytes(self):
+        return self.bits.nbytes
+
+
+def _is_binary_ppm(path):
+    with open(path, 'rb') as f:
+        return f.read(2) == b'P6'
+
+
+class _PPMStripReader:
+    """逐条带读取二进制PPM（P6，maxval=255）图像，不把整幅图像读入内存"""
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        tokens = []
+        while len(tokens) < 4:
+            line = self._file.readline()
+            if not line:
+                raise ValueError(f"PPM文件头不完整: {path}")
+            tokens += line.split(b'#', 1)[0].split()
+        if tokens[0] != b'P6' or int(tokens[3]) != 255:
+            raise ValueError(f"只支持maxval为255的二进制PPM: {path}")
+        self.size = (int(tokens[1]), int(tokens[2]))
+        self._data_offset = self._file.tell()
+
+    def read_strip(self, top, bottom):
+        width = self.size[0]
+        self._file.seek(self._data_offset + top * width * 3)
+        return Image.frombytes('RGB', (width, bottom - top), self._file.read((bottom - top) * width * 3))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._file.close()
+
+
+class _DeflateSegment:
+    """顺序增量解压TIFF中的一个Deflate段，只保留尚未读取的行，内存不随段的大小增长"""
+
+    def __init__(self, file, offset, count, stride):
+        self._file = file
+        self._position, self._remaining = offset, count
+        self._stride = stride
+        self._decompressor = zlib.decompressobj()
+        self._buffer = b''
+        self.row = 0  # _buffer第一行在段内的行号
+
+    def rows(self, first, last):
+        """段内第first到last-1行的原始字节，first不小于上次调用的first"""
+        stride = self._stride
+        while self.row + len(self._buffer) // stride < last:
+            data = self._decompressor.unconsumed_tail
+            if not data:
+                if not self._remaining:
+                    break
+                self._file.seek(self._position)
+                data = self._file.read(min(self._remaining, 1 << 20))
+                self._position += len(data)
+                self._remaining -= len(data)
+            # 每次最多解压4MB，未消耗的压缩数据留在unconsumed_tail中
+            need = (last - self.row) * stride - len(self._buffer)
+            self._buffer += self._decompressor.decompress(data, min(need, 1 << 22))
+            # 丢弃first之前的行
+            skip = min(first - self.row, len(self._buffer) // stride)
+            if skip > 0:
+                self._buffer = self._buffer[skip * stride:]
+                self.row += skip
+        return self._buffer[(first - self.row) * stride:(last - self.row) * stride]
+
+
+class _TiffStripReader:
+    """按行范围读取未压缩或Deflate压缩的TIFF（条带或分块均可），只读取与所需行相交的条带/图块
+
+    文件结构（各段偏移、字节数和原始像素格式）由Pillow解析，像素数据自行读取；
+    未压缩的段只读取需要的行，Deflate压缩的段由_DeflateSegment顺序增量解压，
+    因此整幅图像只有一个条带的文件也不会整段解压到内存中。
+    """
+    # 支持的压缩方式：1为不压缩，8和32946为Deflate
+    COMPRESSIONS = (1, 8, 32946)
+
+    @classmethod
+    def supports(cls, path):
+        """是否为可以按行范围读取的TIFF（单平面存储、无预测器、压缩方式受支持）"""
+        with Image.open(path) as image:
+            if image.format != 'TIFF':
+                return False
+            tags = image.tag_v2
+            return (tags.get(259, 1) in cls.COMPRESSIONS and tags.get(284, 1) == 1
+                    and tags.get(317, 1) == 1)
+
+    def __init__(self, path):
+        with Image.open(path) as image:
+            tags = image.tag_v2
+            self.size = image.size
+            self._mode = image.mode
+            # Pillow为该文件选定的原始像素格式（含位序、字节序）
+            self._rawmode = image.tile[0][3][0]
+            # 调色板图像的颜色表（frombytes重建的条带不带颜色表，需要另外设置）
+            self._palette = image.getpalette() if image.mode in ('P', 'PA') else None
+            self._compression = tags.get(259, 1)
+            bits = tags.get(258, (1,))
+            bits_per_pixel = sum(bits) if len(bits) > 1 else bits[0] * tags.get(277, 1)
+            if 322 in tags:
+                self._segment_size = (tags[322], tags[323])
+                self._offsets, self._counts = tags[324], tags[325]
+            else:
+                self._segment_size = (self.size[0], min(tags.get(278, self.size[1]), self.size[1]))
+                self._offsets, self._counts = tags[273], tags[279]
+        self._across = -(-self.size[0] // self._segment_size[0])
+        self._stride = (self._segment_size[0] * bits_per_pixel + 7) // 8
+        self._cache_row, self._cache = None, {}
+        self._file = open(path, 'rb')
+
+    def _segment_rows(self, index, first, last):
+        """第index个条带/图块中第first到last-1行的原始字节"""
+        if self._compression == 1:
+            self._file.seek(self._offsets[index] + first * self._stride)
+            return self._file.read((last - first) * self._stride)
+        segment = self._cache.get(index)
+        if segment is None or first < segment.row:
+            segment = self._cache[index] = _DeflateSegment(self._file, self._offsets[index],
+                                                           self._counts[index], self._stride)
+        return segment.rows(first, last)
+
+    def read_strip(self, top, bottom):
+        width, height = self.size
+        segment_width, segment_height = self._segment_size
+        strip = Image.new(self._mode, (width, bottom - top))
+        if self._palette is not None:
+            strip.putpalette(self._palette)
+        for row in range(top // segment_height, (bottom - 1) // segment_height + 1):
+            if row != self._cache_row:
+                self._cache_row, self._cache = row, {}
+            y = row * segment_height
+            first, last = max(top, y) - y, min(bottom, y + segment_height, height) - y
+            for column in range(self._across):
+                piece = Image.frombytes(self._mode, (segment_width, last - first),
+                                        self._segment_rows(row * self._across + column, first, last),
+                                        'raw', self._rawmode, self._stride)
+                # 右侧图块超出图像宽度的填充部分由paste裁掉
+                strip.paste(piece, (column * segment_width, y + first - top))
+        return strip
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._file.close()
+
+
+class _PillowStripReader:
+    """通过Pillow按条带裁剪读取图像：第一次裁剪时Pillow按原始模式解码整幅图像，内存随图像大小增长"""
+
+    def __init__(self, path):
+        self._image = Image.open(path)
+        self.size = self._image.size
+
+    def read_strip(self, top, bottom):
+        return self._image.crop((0, top, self.size[0], bottom))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._image.close()
+
+
+class _PPMStripWriter:
+    """逐条带写出二进制PPM图像"""
+
+    def __init__(self, path, width, height):
+        self._file = open(path, 'wb')
+        self._file.write(f"P6\n{width} {height}\n255\n".encode('ascii'))
+
+    def write(self, strip):
+        self._file.write(strip.tobytes())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._file.close()
+
+
+class _TiffStripWriter:
+    """逐条带写出未压缩的RGB TIFF（与Pillow默认保存的TIFF相同），像素数据写完后在文件末尾写入IFD"""
+
+    def __init__(self, path, width, height, rows_per_strip):
+        self._file = open(path, 'wb')
+        # 小端TIFF文件头，IFD偏移在结束时回填
+        self._file.write(b'II*\x00\x00\x00\x00\x00')
+        self._width, self._height, self._rows_per_strip = width, height, rows_per_strip
+        self._offsets, self._counts = [], []
+
+    def write(self, strip):
+        data = strip.tobytes()
+        offset = self._file.tell()
+        if offset + len(data) > 0xFFFFFFFF:
+            raise ValueError("TIFF文件超过4GB，需要BigTIFF格式")
+        self._offsets.append(offset)
+        self._counts.append(len(data))
+        self._file.write(data)
+
+    def _write_ifd(self):
+        if self._file.tell() % 2:
+            self._file.write(b'\x00')  # IFD须从偶数偏移开始
+        # (标签, 类型(3为SHORT, 4为LONG), 值)
+        entries = [(256, 4, [self._width]), (257, 4, [self._height]), (258, 3, [8, 8, 8]), (259, 3, [1]),
+                   (262, 3, [2]), (273, 4, self._offsets), (277, 3, [3]), (278, 4, [self._rows_per_strip]),
+                   (279, 4, self._counts), (284, 3, [1])]
+        ifd_offset = self._file.tell()
+        # 超过4字节的值依次放在IFD之后
+        extra_offset = ifd_offset + 2 + 12 * len(entries) + 4
+        ifd, extra = [struct.pack('<H', len(entries))], []
+        for tag, field_type, values in entries:
+            data = struct.pack(f"<{len(values)}{'H' if field_type == 3 else 'I'}", *values)
+            if len(data) <= 4:
+                ifd.append(struct.pack('<HHI', tag, field_type, len(values)) + data.ljust(4, b'\x00'))
+            else:
+                ifd.append(struct.pack('<HHII', tag, field_type, len(values), extra_offset))
+                extra.append(data)
+                extra_offset += len(data)
+        if extra_offset > 0xFFFFFFFF:
+            raise ValueError("TIFF文件超过4GB，需要BigTIFF格式")
+        ifd.append(struct.pack('<I', 0))
+        self._file.write(b''.join(ifd + extra))
+        self._file.seek(4)
+        self._file.write(struct.pack('<I', ifd_offset))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        try:
+            if exc_type is None:
+                self._write_ifd()
+        finally:
+            self._file.close()
+
+
+class _ImageStripWriter:
+    """把条带拼入整幅RGB画布，结束时按扩展名保存（内存随图像大小增长）"""
+
+    def __init__(self, path, width, height):
+        self._path = path
+        self._image = Image.new('RGB', (width, height))
+        self._top = 0
+
+    def write(self, strip):
+        self._image.paste(strip, (0, self._top))
+        self._top += strip.height
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self._image.save(self._path)
+
+
+class PipelineProfiler:
+    """按阶段统计水印流水线的耗时和内存，跨批量图像累计
+
+    阶段可以嵌套，统计按调用栈（如embed_watermark;generate_text_watermark;rotate_tile）分别累计：
+    调用次数、总/最短/最长耗时，以及内存：net_blocks为阶段前后Python存活内存块数的差（净增量，
+    分配后又释放的内存不计入，可能为负，并非分配次数），track_memory为True时peak_bytes为
+    tracemalloc记录的阶段内相对进入时的峰值内存（tracemalloc本身会明显拖慢被测代码）。
+    耗时统计可在多个线程中同时使用；两项内存指标都是进程级的，只对执行期间没有其他线程
+    处于剖析阶段中的调用记录，memory_calls为记录了内存的调用次数（未被剖析的线程仍会影响结果）。
+    结果可导出为JSON，或导出为flamegraph.pl可读的折叠栈文件（每行"栈 自身耗时微秒"）。
+    """
+
+    def __init__(self, track_memory=False):
+        self.track_memory = track_memory
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # 正处于阶段中的线程及其嵌套深度；有线程在其他线程的阶段期间进入时递增_overlaps
+        self._active = {}
+        self._overlaps = 0
+        if track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def __getstate__(self):
+        # 锁和线程局部数据不能序列化，只带设置；子进程的剖析器由_fresh_worker_profiler重建，不依赖这里
+        return {'track_memory': self.track_memory}
+
+    def __setstate__(self, state):
+        self.__init__(state['track_memory'])
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        frames = getattr(self._local, 'frames', None)
+        if frames is None:
+            frames = self._local.frames = []
+        stack = (frames[-1]['stack'] if frames else ()) + (name,)
+        thread = threading.get_ident()
+        with self._lock:
+            # 与其他线程的阶段重叠时，双方的内存指标都不可靠
+            exclusive = all(other == thread for other in self._active)
+            if not exclusive:
+                self._overlaps += 1
+            self._active[thread] = self._active.get(thread, 0) + 1
+            overlaps = self._overlaps
+        frame = {'stack': stack, 'peak': 0}
+        if self.track_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            # 重置峰值前把目前为止的峰值计入外层阶段
+            if frames:
+                frames[-1]['peak'] = max(frames[-1]['peak'], peak - frames[-1]['base'])
+            tracemalloc.reset_peak()
+            frame['base'] = current
+        frames.append(frame)
+        blocks = sys.getallocatedblocks()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            blocks = sys.getallocatedblocks() - blocks
+            frames.pop()
+            with self._lock:
+                exclusive = exclusive and overlaps == self._overlaps
+                self._active[thread] -= 1
+                if not self._active[thread]:
+                    del self._active[thread]
+            peak_bytes = None
+            if self.track_memory:
+                peak_bytes = max(frame['peak'], tracemalloc.get_traced_memory()[1] - frame['base'])
+                if frames:
+                    frames[-1]['peak'] = max(frames[-1]['peak'], peak_bytes + frame['base'] - frames[-1]['base'])
+            if exclusive:
+                self._record(';'.join(stack), 1, elapsed, elapsed, elapsed, 1, blocks, peak_bytes)
+            else:
+                self._record(';'.join(stack), 1, elapsed, elapsed, elapsed, 0, 0, None)
+
+    def _record(self, key, calls, seconds, min_seconds, max_seconds, memory_calls, net_blocks, peak_bytes):
+        with self._lock:
+            entry = self._stats.get(key)
+            if entry is None:
+                self._stats[key] = {'calls': calls, 'seconds': seconds, 'min_seconds': min_seconds,
+                                    'max_seconds': max_seconds, 'memory_calls': memory_calls,
+                                    'net_blocks': net_blocks, 'peak_bytes': peak_bytes}
+                return
+            entry['calls'] += calls
+            entry['seconds'] += seconds
+            entry['min_seconds'] = min(entry['min_seconds'], min_seconds)
+            entry['max_seconds'] = max(entry['max_seconds'], max_seconds)
+            entry['memory_calls'] += memory_calls
+            entry['net_blocks'] += net_blocks
+            if peak_bytes is not None:
+                entry['peak_bytes'] = max(entry['peak_bytes'] or 0, peak_bytes)
+
+    def report(self):
+        """{调用栈: 统计}，调用栈以';'连接"""
+        with self._lock:
+            return {key: dict(entry) for key, entry in self._stats.items()}
+
+    def drain(self):
+        """取出并清空当前统计（子进程把每个任务的统计交回主进程时使用）"""
+        with self._lock:
+            stats, self._stats = self._stats, {}
+        return stats
+
+    def merge(self, stats):
+        """累加另一份report()/drain()的结果"""
+        for key, entry in stats.items():
+            self._record(key, entry['calls'], entry['seconds'], entry['min_seconds'],
+                         entry['max_seconds'], entry['memory_calls'], entry['net_blocks'], entry['peak_bytes'])
+
+    def reset(self):
+        self.drain()
+
+    def folded_stacks(self):
+        """折叠栈格式的行：各调用栈的自身耗时（总耗时减去直接子阶段的总耗时），单位微秒"""
+        stats = self.report()
+        self_seconds = {key: entry['seconds'] for key, entry in stats.items()}
+        for key, entry in stats.items():
+            parent = key.rpartition(';')[0]
+            if parent in self_seconds:
+                self_seconds[parent] -= entry['seconds']
+        return [f"{key} {max(0, round(seconds * 1e6))}" for key, seconds in sorted(self_seconds.items())]
+
+    def dump(self, path):
+        """按扩展名导出：.json为统计报告，其他（如.folded）为折叠栈文件"""
+        with open(path, 'w', encoding='utf-8') as f:
+            if path.lower().endswith('.json'):
+                json.dump(self.report(), f, indent=2, ensure_ascii=False)
+            else:
+                f.write('\n'.join(self.folded_stacks()) + '\n')
+
+
+def _profiled(stage):
+    """把方法记为一个流水线阶段；实例未启用性能剖析时直接调用"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            if self.profiler is None:
+                return func(self, *args, **kwargs)
+            with self.profiler.stage(stage):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
 class CustomWatermarkDetector:
+    # 生成好的整幅水印图像，按(文本, 字体, 字号比例, 颜色, 种子, 画布尺寸)缓存
+    overlay_cache = ImageLRUCache(max_bytes=256 * 1024 * 1024)
+    # 旋转后的单个文本图块，按(文本, 字体, 字号, 颜色, 角度)缓存
+    glyph_cache = ImageLRUCache(max_bytes=32 * 1024 * 1024)
+    # 性能剖析器，默认不启用（见enable_profiling）
+    profiler = None
+
     def __init__(self, watermark_text="Confidential", seed=42, 
                  font_path=None, font_size_ratio=0.1, 
                  text_color=(255, 255, 255, 30)):
@@ -13,7 +639,21 @@ class CustomWatermarkDetector:
         self.font_path = font_path  # 字体路径
         self.font_size_ratio = font_size_ratio  # 字体大小比例
         self.text_color = text_color  # 水印颜色
-        random.seed(seed)
+        # 每个实例独立的随机数流（用于变换参数），不影响也不依赖全局random
+        self.rng = random.Random(seed)
+
+    def enable_profiling(self, track_memory=False):
+        """为本实例启用按阶段的性能剖析，返回PipelineProfiler"""
+        self.profiler = PipelineProfiler(track_memory)
+        return self.profiler
+
+    def _stage(self, name):
+        """方法内部子阶段的计时上下文，未启用剖析时为空操作"""
+        return self.profiler.stage(name) if self.profiler is not None else contextlib.nullcontext()
+
+    @_profiled('save')
+    def _save_image(self, image, path):
+        image.save(path)
     
     def get_text_size(self, font, text):
         """兼容不同Pillow版本的文本尺寸获取方法"""
@@ -33,25 +673,32 @@ class CustomWatermarkDetector:
                 text_height = bbox[3] - bbox[1]
                 return (text_width, text_height)
         
+    @_profiled('generate_text_watermark')
     def generate_text_watermark(self, size):
-        """生成文本水印图像（支持自定义字体、大小和颜色）"""
+        """生成文本水印图像（支持自定义字体、大小和颜色）
+
+        相同参数和画布尺寸的水印直接从overlay_cache返回，返回的图像被缓存共享，调用方不应原地修改。
+        """
         width, height = size
-        watermark = Image.new('RGBA', (width, height), (0, 0, 0, 0))
-        draw = ImageDraw.Draw(watermark)
-        
-        # 加载字体（支持自定义字体路径）
-        try:
-            # 计算字体大小：图像最小边 * 比例
-            font_size = int(min(width, height) * self.font_size_ratio)
-            if self.font_path:
-                # 使用指定的字体文件
-                font = ImageFont.truetype(self.font_path, font_size)
-            else:
-                # 使用默认字体
-                font = ImageFont.truetype("arial.ttf", font_size)
-        except:
-            #  fallback到系统默认字体
-            font = ImageFont.load_default()
+        cache_key = (self.watermark_text, self.font_path, self.font_size_ratio,
+                     tuple(self.text_color), self.seed, (width, height))
+        watermark = self.overlay_cache.get(cache_key)
+        if watermark is not None:
+            return watermark
+
+        layout = self._watermark_layout((width, height))
+        watermark = self._render_watermark_region(layout, (0, 0, width, height))
+        self.overlay_cache.put(cache_key, watermark)
+        return watermark
+
+    def _watermark_layout(self, size):
+        """计算水印布局：字体、文本尺寸以及每个文本图块的位置和旋转角度"""
+        width, height = size
+
+        # 计算字体大小：图像最小边 * 比例
+        font_size = int(min(width, height) * self.font_size_ratio)
+        with self._stage('load_font'):
+            font = _load_font(self.font_path, font_size)
             
         # 获取文本尺寸
         text_width, text_height = self.get_text_size(font, self.watermark_text)
@@ -60,43 +707,175 @@ class CustomWatermarkDetector:
         x_count = max(1, int(width // (text_width * 2)))
         y_count = max(1, int(height // (text_height * 2)))
         
-        # 随机分布水印文本
+        # 随机分布水印文本：布局只由种子和图像尺寸决定，与调用顺序和其他实例无关
+        rng = random.Random(f"{self.seed}:{width}x{height}")
+        placements = []
         for i in range(x_count):
             for j in range(y_count):
-                x = int(i * text_width * 2 + random.randint(0, int(text_width)))
-                y = int(j * text_height * 2 + random.randint(0, int(text_height)))
-                angle = random.randint(-30, 30)  # 旋转角度
-                
-                # 创建单个文本水印（使用自定义颜色）
-                text_img = Image.new('RGBA', (int(text_width), int(text_height)), (0, 0, 0, 0))
-                text_draw = ImageDraw.Draw(text_img)
-                # 使用自定义颜色绘制文本
-                text_draw.text((0, 0), self.watermark_text, font=font, fill=self.text_color)
-                rotated = text_img.rotate(angle, expand=True)
-                
-                # 粘贴到水印图像上
-                watermark.paste(rotated, (x, y), rotated)
-        
-        return watermark
+                x = int(i * text_width * 2 + rng.randint(0, int(text_width)))
+                y = int(j * text_height * 2 + rng.randint(0, int(text_height)))
+                angle = rng.randint(-30, 30)  # 旋转角度
+                placements.append((x, y, angle))
+
+        return WatermarkLayout(font, font_size, text_width, text_height, placements)
+
+    def _render_watermark_region(self, layout, box):
+        """只渲染水印图像中box=(left, top, right, bottom)范围内的部分
+
+        按布局顺序粘贴与该区域相交的文本图块，结果与整幅水印图像的对应区域逐像素相同。
+        """
+        left, top, right, bottom = box
+        region = Image.new('RGBA', (right - left, bottom - top), (0, 0, 0, 0))
+        for x, y, angle in layout.placements:
+            if x >= right or y >= bottom:
+                continue
+            rotated = self._rotated_text_tile(layout.font, layout.font_size,
+                                              layout.text_width, layout.text_height, angle)
+            if x + rotated.width <= left or y + rotated.height <= top:
+                continue
+            # 粘贴到水印图像上
+            region.paste(rotated, (x - left, y - top), rotated)
+        return region
+
+    @_profiled('rotate_tile')
+    def _rotated_text_tile(self, font, font_size, text_width, text_height, angle):
+        """返回按angle旋转后的单个文本水印图块（按字体和角度缓存）"""
+        cache_key = (self.watermark_text, self.font_path, font_size, tuple(self.text_color), angle)
+        rotated = self.glyph_cache.get(cache_key)
+        if rotated is None:
+            # 创建单个文本水印（使用自定义颜色）
+            text_img = Image.new('RGBA', (int(text_width), int(text_height)), (0, 0, 0, 0))
+            text_draw = ImageDraw.Draw(text_img)
+            # 使用自定义颜色绘制文本
+            text_draw.text((0, 0), self.watermark_text, font=font, fill=self.text_color)
+            rotated = text_img.rotate(angle, expand=True)
+            self.glyph_cache.put(cache_key, rotated)
+        return rotated
     
+    @_profiled('embed_watermark')
     def embed_watermark(self, image_path, output_path=None):
         # 打开原始图像
-        image = Image.open(image_path).convert('RGBA')
+        with self._stage('load_image'):
+            image = Image.open(image_path).convert('RGBA')
         width, height = image.size
 
         # 生成水印
         watermark = self.generate_text_watermark((width, height))
-        # 合并图像和水印
-        watermarked_image = Image.alpha_composite(image, watermark)
-        # 转换回RGB模式以便保存为JPG
-        watermarked_image = watermarked_image.convert('RGB')
+        with self._stage('composite'):
+            # 合并图像和水印
+            watermarked_image = Image.alpha_composite(image, watermark)
+            # 转换回RGB模式以便保存为JPG
+            watermarked_image = watermarked_image.convert('RGB')
         # 保存图像
         if output_path:
-            watermarked_image.save(output_path)
+            self._save_image(watermarked_image, output_path)
         return watermarked_image, watermark
     
-    def apply_transformations(self, image, transform_type):
-        """对图像应用变换"""
+    @_profiled('embed_watermark_tiled')
+    def embed_watermark_tiled(self, image_path, output_path, strip_height=512):
+        """按水平条带为超大图像嵌入水印，峰值内存由条带大小而不是图像大小决定
+
+        每个条带只渲染与之相交的水印图块（布局由种子确定），合成后立即写出。单个旋转文本图块仍需完整渲染。
+        逐条带读取的输入：二进制PPM（P6），以及未压缩或Deflate压缩的条带/分块TIFF；
+        逐条带写出的输出：.ppm/.pnm（P6）和.tif/.tiff（未压缩的RGB条带TIFF）。
+        其他格式的输入由Pillow整幅解码，其他格式的输出先拼入整幅RGB画布再保存，
+        这两种情况峰值内存仍随图像大小增长，会发出警告。
+        返回水印布局，可用于重新生成任意区域的水印。
+        """
+        if _is_binary_ppm(image_path):
+            reader = _PPMStripReader(image_path)
+        elif _TiffStripReader.supports(image_path):
+            reader = _TiffStripReader(image_path)
+        else:
+            warnings.warn(f"{image_path}不是二进制PPM或未压缩/Deflate压缩的TIFF，将整幅解码，"
+                          "峰值内存随图像大小增长", stacklevel=3)
+            reader = _PillowStripReader(image_path)
+        with reader:
+            width, height = reader.size
+            layout = self._watermark_layout((width, height))
+            if output_path.lower().endswith(('.ppm', '.pnm')):
+                writer = _PPMStripWriter(output_path, width, height)
+            elif output_path.lower().endswith(('.tif', '.tiff')):
+                writer = _TiffStripWriter(output_path, width, height, strip_height)
+            else:
+                warnings.warn(f"{output_path}不是PPM或TIFF输出，将先拼成整幅图像再保存，"
+                              "峰值内存随图像大小增长", stacklevel=3)
+                writer = _ImageStripWriter(output_path, width, height)
+
+            with writer:
+                for top in range(0, height, strip_height):
+                    box = (0, top, width, min(top + strip_height, height))
+                    strip = reader.read_strip(box[1], box[3]).convert('RGBA')
+                    overlay = self._render_watermark_region(layout, box)
+                    writer.write(Image.alpha_composite(strip, overlay).convert('RGB'))
+        return layout
+
+    def iter_embed_directory(self, src_dir, dst_dir, workers=None):
+        """批量为src_dir中的图像嵌入水印并写入dst_dir，按完成顺序逐个产出结果
+
+        图像按尺寸排序后分发到进程池，各进程的overlay_cache使同尺寸图像复用同一水印；
+        每个结果为{'source', 'output', 'size', 'latency'}，失败时带'error'。
+        """
+        os.makedirs(dst_dir, exist_ok=True)
+        tasks = []
+        for name in sorted(os.listdir(src_dir)):
+            src_path = os.path.join(src_dir, name)
+            if not name.lower().endswith(IMAGE_EXTENSIONS) or not os.path.isfile(src_path):
+                continue
+            try:
+                with Image.open(src_path) as img:
+                    size = img.size  # 只读取文件头
+            except OSError:
+                size = (0, 0)
+            tasks.append((size, src_path, os.path.join(dst_dir, name)))
+        tasks.sort(key=lambda task: task[0])
+
+        workers = workers or os.cpu_count() or 1
+        if workers == 1:
+            for _, src_path, dst_path in tasks:
+                yield _embed_one(self, src_path, dst_path)
+            return
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker,
+                                 initargs=(self,)) as executor:
+            futures = [executor.submit(_embed_batch_task, src_path, dst_path)
+                       for _, src_path, dst_path in tasks]
+            for future in as_completed(futures):
+                yield self._merge_worker_profile(future.result())
+
+    def embed_directory(self, src_dir, dst_dir, workers=None):
+        """批量嵌入水印，逐个打印单张耗时，返回包含吞吐量的汇总"""
+        start = time.perf_counter()
+        results = []
+        for result in self.iter_embed_directory(src_dir, dst_dir, workers):
+            results.append(result)
+            name = os.path.basename(result['source'])
+            if 'error' in result:
+                print(f"{name}: 失败 {result['error']}")
+            else:
+                print(f"{name}: {result['latency'] * 1000:.1f} ms")
+        elapsed = time.perf_counter() - start
+        succeeded = [result for result in results if 'error' not in result]
+        summary = {
+            'images': len(succeeded),
+            'failed': len(results) - len(succeeded),
+            'elapsed': elapsed,
+            'images_per_sec': len(succeeded) / elapsed if elapsed > 0 else 0.0,
+            'mean_latency': sum(r['latency'] for r in succeeded) / len(succeeded) if succeeded else 0.0,
+            'results': results,
+        }
+        print(f"共处理{summary['images']}张图像，失败{summary['failed']}张，"
+              f"用时{elapsed:.2f}秒，{summary['images_per_sec']:.2f}张/秒")
+        return summary
+
+    @_profiled('apply_transformations')
+    def apply_transformations(self, image, transform_type, **params):
+        """对图像应用变换
+
+        可选参数：crop的ratio/left/top，resize的scale，brightness/contrast的factor，
+        rotate的angle/expand；未给出的随机参数由_resolve_transform_params随机选取。
+        """
+        params = self._resolve_transform_params(image.size, transform_type, params)
         transformed = image.copy()
         if transform_type == 'flip_horizontal':
             transformed = image.transpose(Image.FLIP_LEFT_RIGHT)
@@ -106,78 +885,289 @@ class CustomWatermarkDetector:
             transformed = image.rotate(90, expand=True)
         elif transform_type == 'rotate_180':
             transformed = image.rotate(180)
+        elif transform_type == 'rotate':
+            transformed = image.rotate(params['angle'], expand=params.get('expand', False))
         elif transform_type == 'crop':
             width, height = image.size
-            new_width = int(width * 0.8)
-            new_height = int(height * 0.8)
-            left = random.randint(0, width - new_width)
-            top = random.randint(0, height - new_height)
+            new_width = int(width * params['ratio'])
+            new_height = int(height * params['ratio'])
+            left, top = params['left'], params['top']
             transformed = image.crop((left, top, left + new_width, top + new_height))
             transformed = transformed.resize((width, height))
         elif transform_type == 'resize':
             width, height = image.size
-            transformed = image.resize((int(width * 0.5), int(height * 0.5)))
+            scale = params.get('scale', 0.5)
+            transformed = image.resize((int(width * scale), int(height * scale)))
             transformed = transformed.resize((width, height))
         elif transform_type == 'brightness':
             enhancer = ImageEnhance.Brightness(image)
-            transformed = enhancer.enhance(random.uniform(0.5, 1.5))
+            transformed = enhancer.enhance(params['factor'])
         elif transform_type == 'contrast':
             enhancer = ImageEnhance.Contrast(image)
-            transformed = enhancer.enhance(random.uniform(0.5, 1.5))
-        else:
-            raise ValueError(f"不支持的变换类型: {transform_type}")
+            transformed = enhancer.enhance(params['factor'])
         return transformed
+
+    def _resolve_transform_params(self, image_size, transform_type, params):
+        """补全变换参数：用实例的随机数流按原有顺序为裁剪位置、亮度/对比度系数抽取随机值"""
+        if transform_type not in TRANSFORM_TYPES:
+            raise ValueError(f"不支持的变换类型: {transform_type}")
+        params = dict(params)
+        if transform_type == 'rotate':
+            params.setdefault('angle', 90)
+        elif transform_type == 'crop':
+            width, height = image_size
+            ratio = params.setdefault('ratio', 0.8)
+            if params.get('left') is None:
+                params['left'] = self.rng.randint(0, width - int(width * ratio))
+            if params.get('top') is None:
+                params['top'] = self.rng.randint(0, height - int(height * ratio))
+        elif transform_type in ('brightness', 'contrast'):
+            if params.get('factor') is None:
+                params['factor'] = self.rng.uniform(0.5, 1.5)
+        return params
     
-    def detect_watermark(self, image, original_watermark):
-        """检测图像中是否存在水印"""
-        img_rgba = image.convert('RGBA')
-        wm_rgba = original_watermark.convert('RGBA')
-        width, height = img_rgba.size
-        wm_width, wm_height = wm_rgba.size
-        if (width, height) != (wm_width, wm_height):
-            wm_rgba = wm_rgba.resize((width, height))
-        match_count = 0
-        total_count = 0
-        for y in range(height):
-            for x in range(width):
-                wm_pixel = wm_rgba.getpixel((x, y))
-                if wm_pixel[3] > 0:
-                    img_pixel = img_rgba.getpixel((x, y))
-                    img_brightness = (img_pixel[0] + img_pixel[1] + img_pixel[2]) / 3
-                    # 根据水印颜色调整检测阈值（这里以深色水印为例）
-                    if self.text_color[3] > 0 and sum(self.text_color[:3]) < 382:  # 深色水印
-                        if img_brightness < 128:
-                            match_count += 1
-                    else:  # 浅色水印
-                        if img_brightness > 128:
-                            match_count += 1
-                    total_count += 1
+    @_profiled('detect_watermark')
+    def detect_watermark(self, image, original_watermark=None):
+        """检测图像中是否存在水印，未给出original_watermark时按种子和图像尺寸重新生成"""
+        # 已是目标模式的图像直接使用，不再复制
+        img_rgb = image if image.mode in ('RGB', 'RGBA') else image.convert('RGBA')
+        if original_watermark is None:
+            original_watermark = self.generate_text_watermark(img_rgb.size)
+        mask = self._reference_mask(original_watermark, img_rgb.size)
+        total_count = mask.count()
         if total_count == 0:
             return 0.0
+
+        # 匹配像素同样打包后与掩码按位与，直接在打包形式上计数
+        match_count = _popcount(np.packbits(self._match_map(img_rgb), axis=1) & mask.bits)
         return (match_count / total_count) * 100
+
+    def _reference_mask(self, original_watermark, size):
+        """把参考水印（PackedMask或RGBA水印图像）转为与图像尺寸一致的PackedMask"""
+        if isinstance(original_watermark, PackedMask):
+            return original_watermark if original_watermark.size == size else original_watermark.resize(size)
+        wm_rgba = original_watermark if original_watermark.mode == 'RGBA' else original_watermark.convert('RGBA')
+        # 只用到alpha通道，单独缩放alpha与缩放整幅RGBA图像后取alpha的结果相同
+        wm_alpha = wm_rgba.getchannel('A')
+        if wm_alpha.size != size:
+            wm_alpha = wm_alpha.resize(size)
+        # 水印覆盖的像素：alpha > 0
+        return PackedMask.from_alpha(wm_alpha)
+
+    def _match_map(self, image):
+        """返回与水印颜色匹配的像素（深色水印匹配暗像素，浅色水印匹配亮像素）"""
+        img_rgb = image if image.mode in ('RGB', 'RGBA') else image.convert('RGBA')
+        # 亮度 (r+g+b)/3 与128比较，等价于 r+g+b 与384比较，避免浮点运算
+        pixels = np.asarray(img_rgb)
+        rgb_sum = pixels[..., 0].astype(np.uint16) + pixels[..., 1] + pixels[..., 2]
+        if self.text_color[3] > 0 and sum(self.text_color[:3]) < 382:  # 深色水印
+            return rgb_sum < 384
+        return rgb_sum > 384  # 浅色水印
+
+    @_profiled('detect_watermark_aligned')
+    def detect_watermark_aligned(self, image, original_watermark=None, scales=ALIGNMENT_SCALES,
+                                 search_size=128, refine_size=512, text_pixels=8, candidates=3):
+        """搜索翻转、旋转和裁剪偏移后检测水印，返回WatermarkAlignment
+
+        对每个候选的翻转/旋转和裁剪比例，把同样变换后的水印掩码放大到图像尺寸除以比例，
+        与高通后的图像亮度做FFT互相关，一次算出所有偏移的相关值；变换后宽高比与图像不符的翻转/旋转直接跳过。
+        搜索分辨率取最长边为search_size，但文本（字号由最短边决定）在该分辨率下不足text_pixels像素高时
+        相应提高，避免细长图像上文字缩没；细化分辨率与搜索分辨率保持refine_size/search_size的比例。
+        相关最强的candidates个对齐在细化分辨率下细化偏移后，与不变换的对齐一起按detect_watermark的方式计分，
+        返回得分最高者，因此结果不会低于detect_watermark。未给出original_watermark时按种子和图像尺寸重新生成。
+        """
+        matched = self._match_map(image)
+        height, width = matched.shape
+        if original_watermark is None:
+            original_watermark = self.generate_text_watermark((width, height))
+        if isinstance(original_watermark, PackedMask):
+            wm_alpha = original_watermark.to_image()
+        else:
+            wm_rgba = original_watermark if original_watermark.mode == 'RGBA' else original_watermark.convert('RGBA')
+            wm_alpha = wm_rgba.getchannel('A')
+        if not wm_alpha.getbbox():
+            return WatermarkAlignment(0.0, 'identity', 1.0, (0, 0), 0.0)
+
+        # 相关用高通后的亮度：减去局部均值去掉图像本身的低频内容，深色水印取反使水印处为正
+        luminance = image.convert('L')
+        text_height = max(1.0, min(width, height) * self.font_size_ratio)
+        radius = max(2, round(text_height / 8))
+        field = Image.fromarray(np.asarray(luminance, dtype=np.float32)
+                                - np.asarray(luminance.filter(ImageFilter.BoxBlur(radius)), dtype=np.float32))
+        if self.text_color[3] > 0 and sum(self.text_color[:3]) < 382:
+            field = Image.fromarray(-np.asarray(field))
+
+        def level(factor):
+            level_size = (max(1, round(width * factor)), max(1, round(height * factor)))
+            level_field = np.asarray(field.resize(level_size, Image.BOX), dtype=np.float64)
+            return level_size, level_field - level_field.mean()
+
+        def mask_size(level_size, scale):
+            return (max(level_size[0], round(level_size[0] / scale)),
+                    max(level_size[1], round(level_size[1] / scale)))
+
+        def oriented(base, method, size, resample=Image.BOX):
+            # 先缩放再翻转/旋转，与先变换再缩放相同，但同一裁剪比例下的各候选可共享缩放结果
+            resized = base.resize((size[1], size[0]) if method in _AXIS_SWAPPING_TRANSPOSES else size, resample)
+            return resized if method is None else resized.transpose(method)
+
+        longest = max(width, height)
+        search_factor = min(1.0, max(search_size / longest, text_pixels / text_height))
+        refine_factor = min(1.0, max(refine_size / longest, search_factor * refine_size / search_size))
+        search_level, search_field = level(search_factor)
+        refine_level, refine_field = level(refine_factor)
+        # 掩码先各缩小一次到搜索和细化分辨率所需的最大尺寸，之后各候选都从它们缩放
+        full_float = Image.fromarray((np.asarray(wm_alpha) > 0).astype(np.float32))
+        refine_mask = full_float.resize((max(1, round(refine_level[0] / min(scales))),
+                                         max(1, round(refine_level[1] / min(scales)))), Image.BOX)
+        search_mask = refine_mask.resize((max(1, round(search_level[0] / min(scales))),
+                                          max(1, round(search_level[1] / min(scales)))), Image.BOX)
+
+        # 裁剪和缩放不改变宽高比：变换后宽高比与图像明显不符的翻转/旋转不可能对齐，不必搜索
+        # （细长图像上交换宽高的候选要把掩码拉伸数倍，既费时又容易产生虚假的相关峰）
+        wm_width, wm_height = wm_alpha.size
+        transposes = []
+        for name, method in ALIGNMENT_TRANSPOSES.items():
+            if method in _AXIS_SWAPPING_TRANSPOSES:
+                aspect = wm_height / wm_width / (width / height)
+            else:
+                aspect = wm_width / wm_height / (width / height)
+            if method is None or 1 / 1.1 <= aspect <= 1.1:
+                transposes.append((name, method))
+
+        searched = []
+        field_spectra = {}
+        for scale in scales:
+            size = mask_size(search_level, scale)
+            resized = {}
+            for name, method in transposes:
+                swap = method in _AXIS_SWAPPING_TRANSPOSES
+                if swap not in resized:
+                    resized[swap] = search_mask.resize((size[1], size[0]) if swap else size, Image.BOX)
+                candidate = resized[swap] if method is None else resized[swap].transpose(method)
+                strength, offset = _best_alignment(np.asarray(candidate, dtype=np.float64), search_field, field_spectra)
+                searched.append((strength, name, scale, offset))
+        searched.sort(key=lambda item: item[0], reverse=True)
+
+        full_masks = {}
+
+        def score(name, scale, left, top):
+            """在原分辨率下按对齐后的水印掩码计分，返回(得分, 实际使用的偏移)"""
+            full_mask = full_masks.get((name, scale))
+            if full_mask is None:
+                full_mask = full_masks[(name, scale)] = np.asarray(oriented(
+                    wm_alpha, ALIGNMENT_TRANSPOSES[name], mask_size((width, height), scale), Image.BICUBIC)) > 0
+            left, top = min(full_mask.shape[1] - width, left), min(full_mask.shape[0] - height, top)
+            window = full_mask[top:top + height, left:left + width]
+            total_count = int(np.count_nonzero(window))
+            value = int(np.count_nonzero(matched & window)) / total_count * 100 if total_count else 0.0
+            return value, (left, top)
+
+        # 不变换的对齐：与detect_watermark的计分完全相同，作为结果的下限
+        identity_strength = next((item[0] for item in searched if item[1] == 'identity' and item[2] == 1.0),
+                                 None)
+        if identity_strength is None:
+            identity_strength, _ = _best_alignment(
+                np.asarray(oriented(search_mask, None, search_level), dtype=np.float64), search_field)
+        identity_score, identity_offset = score('identity', 1.0, 0, 0)
+        best = WatermarkAlignment(identity_score, 'identity', 1.0, identity_offset, identity_strength)
+
+        # 细化：搜索分辨率下的一个像素约对应细化分辨率下ratio个像素
+        ratio = refine_factor / search_factor
+        radius = int(np.ceil(ratio)) + 1
+        for strength, name, scale, (dx, dy) in searched[:candidates]:
+            mask = np.asarray(oriented(refine_mask, ALIGNMENT_TRANSPOSES[name], mask_size(refine_level, scale)),
+                              dtype=np.float64)
+            x_range, y_range = mask.shape[1] - refine_level[0], mask.shape[0] - refine_level[1]
+            x0, x1 = max(0, round(dx * ratio) - radius), min(x_range, round(dx * ratio) + radius)
+            y0, y1 = max(0, round(dy * ratio) - radius), min(y_range, round(dy * ratio) + radius)
+            _, (rx, ry) = _best_alignment(mask[y0:y1 + refine_level[1], x0:x1 + refine_level[0]], refine_field)
+            value, offset = score(name, scale, round((x0 + rx) / refine_factor), round((y0 + ry) / refine_factor))
+            if value > best.score:
+                best = WatermarkAlignment(value, name, scale, offset, strength)
+        return best
     
+    def _reference_watermark(self, watermark, output_dir=None):
+        """把embed_watermark返回的水印图像转为检测用的参考水印（1比特掩码）
+
+        给出output_dir时把掩码保存为original_watermark.pbm；盲检测的子类可改为返回None。
+        """
+        mask = PackedMask.from_image(watermark)
+        if output_dir:
+            mask.save(os.path.join(output_dir, "original_watermark.pbm"))
+        return mask
+
     def test_robustness(self, original_image_path, output_dir="results"):
-        """测试水印鲁棒性"""
+        """测试水印鲁棒性（参考水印由_reference_watermark生成并保存，用于检测）"""
         os.makedirs(output_dir, exist_ok=True)
         watermarked_image, original_watermark = self.embed_watermark(original_image_path)
-        watermarked_image.save(os.path.join(output_dir, "watermarked.jpg"))
-        wm_visual = Image.new('RGB', original_watermark.size, (255, 255, 255))
-        wm_visual.paste(original_watermark, mask=original_watermark.split()[3])
-        wm_visual.save(os.path.join(output_dir, "original_watermark.jpg"))
-        transform_types = [
+        self._save_image(watermarked_image, os.path.join(output_dir, "watermarked.jpg"))
+        original_watermark = self._reference_watermark(original_watermark, output_dir)
+        transform_grid = [(transform, {}) for transform in [
             'flip_horizontal', 'flip_vertical', 'rotate_90', 'rotate_180',
             'crop', 'resize', 'brightness', 'contrast'
-        ]
+        ]]
+        cells = self._score_transform_grid(watermarked_image, original_watermark, transform_grid,
+                                           workers=1, output_dir=output_dir)
         results = []
         print("鲁棒性测试结果:")
-        for transform in transform_types:
-            transformed = self.apply_transformations(watermarked_image, transform)
-            transformed.save(os.path.join(output_dir, f"transformed_{transform}.jpg"))
-            similarity = self.detect_watermark(transformed, original_watermark)
-            results.append((transform, similarity))
-            transform_name = self._get_transform_name(transform)
-            print(f"{transform_name}: {similarity:.2f}%")
+        for cell in cells:
+            results.append((cell['transform'], cell['score']))
+            transform_name = self._get_transform_name(cell['transform'])
+            print(f"{transform_name}: {cell['score']:.2f}%")
         return results
+
+    def run_robustness_matrix(self, original_image_path, transform_grid=None, workers=None,
+                              output_dir=None, matrix_path=None, aligned=False):
+        """按变换参数网格并行测试水印鲁棒性
+
+        transform_grid为{变换类型: [参数字典, ...]}或[(变换类型, 参数字典), ...]，默认DEFAULT_TRANSFORM_GRID；
+        给出output_dir时保存水印图像和每个变换后的图像，给出matrix_path时按扩展名写出CSV或JSON矩阵。
+        aligned为True时用detect_watermark_aligned检测，结果中另记录找到的对齐。
+        返回按网格顺序排列的结果，每项包含得分和变换、检测、保存各自的耗时（毫秒）。
+        """
+        watermarked_image, original_watermark = self.embed_watermark(original_image_path)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+            self._save_image(watermarked_image, os.path.join(output_dir, "watermarked.jpg"))
+        # 传给检测和子进程的只是1比特掩码
+        original_watermark = self._reference_watermark(original_watermark, output_dir)
+        cells = self._score_transform_grid(watermarked_image, original_watermark,
+                                           transform_grid or DEFAULT_TRANSFORM_GRID, workers, output_dir, aligned)
+        if matrix_path:
+            _write_robustness_matrix(cells, matrix_path)
+        return cells
+
+    def _score_transform_grid(self, watermarked_image, original_watermark, transform_grid,
+                              workers=None, output_dir=None, aligned=False):
+        """对网格中每个单元应用变换并检测，workers大于1时在进程池中并行"""
+        if isinstance(transform_grid, dict):
+            transform_grid = [(transform, params) for transform, sweep in transform_grid.items()
+                              for params in sweep]
+        # 在当前进程中按网格顺序补全随机参数，保证各单元结果与调度顺序无关
+        cells = []
+        for index, (transform, params) in enumerate(transform_grid):
+            label = transform + ''.join(f"_{key}{value}" for key, value in sorted(params.items()))
+            resolved = self._resolve_transform_params(watermarked_image.size, transform, params)
+            cells.append((index, label, transform, resolved))
+
+        workers = workers or os.cpu_count() or 1
+        if workers == 1:
+            return [_score_robustness_cell(self, watermarked_image, original_watermark, output_dir, aligned, *cell)
+                    for cell in cells]
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_robustness_worker,
+                                 initargs=(self, watermarked_image, original_watermark, output_dir, aligned)) as executor:
+            futures = [executor.submit(_robustness_cell_task, *cell) for cell in cells]
+            results = [self._merge_worker_profile(future.result()) for future in as_completed(futures)]
+        return sorted(results, key=lambda result: result['index'])
+
+    def _merge_worker_profile(self, result):
+        """把子进程随结果交回的剖析统计并入本实例的剖析器"""
+        profile = result.pop('profile', None)
+        if profile:
+            self.profiler.merge(profile)
+        return result
     
     def _get_transform_name(self, transform_type):
         names = {
@@ -188,10 +1178,278 @@ class CustomWatermarkDetector:
             'crop': '裁剪',
             'resize': '缩放',
             'brightness': '亮度调整',
-            'contrast': '对比度调整'
+            'contrast': '对比度调整',
+            'rotate': '任意角度旋转'
         }
         return names.get(transform_type, transform_type)
 
+
+def _dct_matrix(n=8):
+    """n×n正交DCT-II变换矩阵，块变换为 C @ B @ C.T，逆变换为 C.T @ D @ C"""
+    k = np.arange(n)
+    matrix = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+# 8×8 DCT块中嵌入水印的中频系数（u + v为3或4）
+MID_FREQUENCY_COEFFICIENTS = tuple((u, v) for u in range(8) for v in range(8) if 3 <= u + v <= 4)
+
+
+class DCTWatermarkDetector(CustomWatermarkDetector):
+    """频域不可见水印：在亮度通道8×8 DCT块的中频系数中扩频嵌入由种子导出的比特序列
+
+    每个比特按交错方式分散到全图各块的系数上，用由种子导出的±1伪随机序列调制后叠加。
+    检测是盲检测：只需种子，不需要原始图像或水印图像，对每个比特求系数与伪随机序列的相关并取符号，
+    得分为正确恢复的比特百分比（约50%即无水印）。沿用父类的apply_transformations、test_robustness
+    和run_robustness_matrix，便于与可见文本水印比较鲁棒性和吞吐量。
+    """
+
+    BLOCK = 8
+    _dct = _dct_matrix(BLOCK)
+
+    def __init__(self, seed=42, strength=3.0, bit_count=64, coefficients=MID_FREQUENCY_COEFFICIENTS,
+                 watermark_text="DCT"):
+        super().__init__(watermark_text=watermark_text, seed=seed)
+        if bit_count <= 0:
+            raise ValueError("比特数必须为正数")
+        self.strength = strength
+        self.bit_count = bit_count
+        self.coefficients = tuple(coefficients)
+        self._coefficient_rows = np.array([u for u, _ in self.coefficients])
+        self._coefficient_cols = np.array([v for _, v in self.coefficients])
+
+    def watermark_bits(self):
+        """由种子导出的比特序列（0/1）"""
+        return np.random.default_rng([self.seed, 0]).integers(0, 2, self.bit_count)
+
+    def _chips(self, grid_shape):
+        """块网格上每个嵌入系数的扩频码片：比特符号×伪随机±1，以及每个码片所属的比特下标"""
+        chip_count = grid_shape[0] * grid_shape[1] * len(self.coefficients)
+        pn = np.random.default_rng([self.seed, 1, *grid_shape]).integers(0, 2, chip_count) * 2 - 1
+        bit_index = np.arange(chip_count) % self.bit_count
+        signs = self.watermark_bits()[bit_index] * 2 - 1
+        return (pn * signs).reshape(*grid_shape, len(self.coefficients)), pn, bit_index
+
+    def _block_coefficients(self, luminance):
+        """把亮度按8×8分块（丢弃不足一块的边缘）并做DCT，返回形状(块行, 块列, 8, 8)"""
+        height, width = luminance.shape
+        rows, cols = height // self.BLOCK, width // self.BLOCK
+        blocks = luminance[:rows * self.BLOCK, :cols * self.BLOCK].reshape(
+            rows, self.BLOCK, cols, self.BLOCK).transpose(0, 2, 1, 3)
+        return self._dct @ blocks @ self._dct.T
+
+    @_profiled('embed_watermark')
+    def embed_watermark(self, image_path, output_path=None):
+        """嵌入不可见水印，返回(水印图像, 嵌入信号的可视化RGBA图像)"""
+        image = Image.open(image_path).convert('YCbCr')
+        y, cb, cr = image.split()
+        luminance = np.asarray(y, dtype=np.float64)
+        coefficients = self._block_coefficients(luminance)
+        rows, cols = coefficients.shape[:2]
+        if rows == 0 or cols == 0:
+            raise ValueError(f"图像尺寸不足一个{self.BLOCK}×{self.BLOCK}块: {image.size}")
+
+        chips, _, _ = self._chips((rows, cols))
+        coefficients[..., self._coefficient_rows, self._coefficient_cols] += self.strength * chips
+        blocks = self._dct.T @ coefficients @ self._dct
+        marked = luminance.copy()
+        marked[:rows * self.BLOCK, :cols * self.BLOCK] = blocks.transpose(0, 2, 1, 3).reshape(
+            rows * self.BLOCK, cols * self.BLOCK)
+        marked = np.clip(np.rint(marked), 0, 255).astype(np.uint8)
+
+        watermarked_image = Image.merge('YCbCr', (Image.fromarray(marked), cb, cr)).convert('RGB')
+        if output_path:
+            self._save_image(watermarked_image, output_path)
+        # 嵌入信号放大后居中于灰色显示
+        delta = marked.astype(np.int16) - np.asarray(y, dtype=np.int16)
+        visual = np.clip(128 + delta * 32, 0, 255).astype(np.uint8)
+        watermark = Image.merge('RGBA', (Image.fromarray(visual),) * 3 + (Image.new('L', image.size, 255),))
+        return watermarked_image, watermark
+
+    def bit_correlations(self, image):
+        """每个比特上系数与扩频码的相关值（符号为判决结果）"""
+        luminance = np.asarray(image.convert('L'), dtype=np.float64)
+        coefficients = self._block_coefficients(luminance)
+        rows, cols = coefficients.shape[:2]
+        if rows == 0 or cols == 0:
+            return np.zeros(self.bit_count)
+        _, pn, bit_index = self._chips((rows, cols))
+        values = coefficients[..., self._coefficient_rows, self._coefficient_cols].reshape(-1)
+        return np.bincount(bit_index, weights=values * pn, minlength=self.bit_count)
+
+    def _reference_watermark(self, watermark, output_dir=None):
+        """盲检测不需要参考水印，返回None；给出output_dir时只把嵌入信号的可视化保存为embedded_signal.png"""
+        if output_dir:
+            self._save_image(watermark, os.path.join(output_dir, "embedded_signal.png"))
+        return None
+
+    @_profiled('detect_watermark')
+    def detect_watermark(self, image, original_watermark=None):
+        """盲检测：返回正确恢复的比特百分比，original_watermark仅为与父类接口一致而保留"""
+        decoded = self.bit_correlations(image) > 0
+        return float(np.mean(decoded == self.watermark_bits().astype(bool)) * 100)
+
+
+# 支持的变换类型
+TRANSFORM_TYPES = (
+    'flip_horizontal', 'flip_vertical', 'rotate_90', 'rotate_180', 'rotate',
+    'crop', 'resize', 'brightness', 'contrast'
+)
+
+# run_robustness_matrix默认的变换参数网格
+DEFAULT_TRANSFORM_GRID = {
+    'flip_horizontal': [{}],
+    'flip_vertical': [{}],
+    'rotate_90': [{}],
+    'rotate_180': [{}],
+    'rotate': [{'angle': angle} for angle in (2, 5, 15, 30, 45)],
+    'crop': [{'ratio': ratio} for ratio in (0.95, 0.9, 0.8, 0.7, 0.6)],
+    'resize': [{'scale': scale} for scale in (0.75, 0.5, 0.25)],
+    'brightness': [{'factor': factor} for factor in (0.5, 0.75, 1.25, 1.5)],
+    'contrast': [{'factor': factor} for factor in (0.5, 0.75, 1.25, 1.5)],
+}
+
+# 鲁棒性测试子进程中的上下文（由进程池initializer设置）
+_robustness_context = None
+
+
+def _fresh_worker_profiler(detector):
+    """子进程中换上空的剖析器
+
+    以fork方式启动子进程时initargs不经序列化，子进程会继承主进程已有的统计，
+    若不清空，第一个任务drain时会把这些统计再交回主进程重复累加。
+    """
+    if detector.profiler is not None:
+        detector.profiler = PipelineProfiler(detector.profiler.track_memory)
+
+
+def _init_robustness_worker(detector, watermarked_image, original_watermark, output_dir, aligned):
+    global _robustness_context
+    _fresh_worker_profiler(detector)
+    _robustness_context = (detector, watermarked_image, original_watermark, output_dir, aligned)
+
+
+def _score_robustness_cell(detector, watermarked_image, original_watermark, output_dir, aligned,
+                           index, label, transform, params):
+    """对一个网格单元应用变换、（可选）保存并检测，记录各阶段耗时"""
+    start = time.perf_counter()
+    transformed = detector.apply_transformations(watermarked_image, transform, **params)
+    transformed_at = time.perf_counter()
+    save_ms = 0.0
+    if output_dir:
+        detector._save_image(transformed, os.path.join(output_dir, f"transformed_{label}.jpg"))
+        save_ms = (time.perf_counter() - transformed_at) * 1000
+    detect_start = time.perf_counter()
+    alignment = None
+    if aligned:
+        alignment = detector.detect_watermark_aligned(transformed, original_watermark)
+        score = alignment.score
+    else:
+        score = detector.detect_watermark(transformed, original_watermark)
+    cell = {
+        'index': index,
+        'label': label,
+        'transform': transform,
+        'params': params,
+        'score': score,
+        'transform_ms': (transformed_at - start) * 1000,
+        'save_ms': save_ms,
+        'detect_ms': (time.perf_counter() - detect_start) * 1000,
+    }
+    if alignment is not None:
+        cell['alignment'] = {'transform': alignment.transform, 'scale': alignment.scale,
+                             'offset': list(alignment.offset), 'correlation': alignment.correlation}
+    return cell
+
+
+def _robustness_cell_task(index, label, transform, params):
+    return _attach_profile(_robustness_context[0],
+                           _score_robustness_cell(*_robustness_context, index, label, transform, params))
+
+
+def _attach_profile(detector, result):
+    """子进程中的检测器启用了剖析时，把本任务的统计随结果交回主进程"""
+    if detector.profiler is not None:
+        result['profile'] = detector.profiler.drain()
+    return result
+
+
+def _write_robustness_matrix(cells, path):
+    """按扩展名把鲁棒性矩阵写成CSV或JSON"""
+    if path.lower().endswith('.csv'):
+        fields = ['label', 'transform', 'params', 'score', 'transform_ms', 'detect_ms', 'save_ms']
+        if any('alignment' in cell for cell in cells):
+            fields.append('alignment')
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=fields, extrasaction='ignore')
+            writer.writeheader()
+            for cell in cells:
+                row = dict(cell, params=json.dumps(cell['params'], sort_keys=True))
+                if 'alignment' in cell:
+                    row['alignment'] = json.dumps(cell['alignment'], sort_keys=True)
+                writer.writerow(row)
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(cells, f, indent=2, ensure_ascii=False)
+
+
+def compare_watermark_engines(image_path, detectors, transform_grid=None, workers=1, repeat=3):
+    """在同一图像和变换网格上比较多个水印引擎的鲁棒性和嵌入/检测吞吐量
+
+    detectors为{名称: 检测器}，返回{名称: {'embed_ms', 'megapixels_per_s', 'detect_ms', 'mean_score', 'cells'}}；
+    嵌入耗时取repeat次的中位数（缓存已预热），detect_ms为网格各单元检测耗时的平均值。
+    """
+    with Image.open(image_path) as image:
+        megapixels = image.size[0] * image.size[1] / 1e6
+    report = {}
+    for name, detector in detectors.items():
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            detector.embed_watermark(image_path)
+            timings.append(time.perf_counter() - start)
+        embed_seconds = sorted(timings)[len(timings) // 2]
+        cells = detector.run_robustness_matrix(image_path, transform_grid, workers=workers)
+        report[name] = {
+            'embed_ms': embed_seconds * 1000,
+            'megapixels_per_s': megapixels / embed_seconds,
+            'detect_ms': sum(cell['detect_ms'] for cell in cells) / len(cells),
+            'mean_score': sum(cell['score'] for cell in cells) / len(cells),
+            'cells': cells,
+        }
+    return report
+
+
+# 批量处理时识别的图像扩展名
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp')
+
+# 批量处理子进程中的检测器实例（由进程池initializer设置）
+_batch_detector = None
+
+
+def _init_batch_worker(detector):
+    global _batch_detector
+    _fresh_worker_profiler(detector)
+    _batch_detector = detector
+
+
+def _embed_one(detector, src_path, dst_path):
+    """嵌入单张图像并记录耗时"""
+    start = time.perf_counter()
+    try:
+        watermarked_image, _ = detector.embed_watermark(src_path, dst_path)
+    except Exception as e:
+        return {'source': src_path, 'output': dst_path, 'error': str(e),
+                'latency': time.perf_counter() - start}
+    return {'source': src_path, 'output': dst_path, 'size': watermarked_image.size,
+            'latency': time.perf_counter() - start}
+
+
+def _embed_batch_task(src_path, dst_path):
+    return _attach_profile(_batch_detector, _embed_one(_batch_detector, src_path, dst_path))
+
+
 if __name__ == "__main__":
     # 自定义水印设置
     detector1 = CustomWatermarkDetector(
@@ -201,7 +1459,44 @@ if __name__ == "__main__":
         font_size_ratio=0.1,  # 字体大小为图像最小边的10%
         text_color=(0, 0, 0, 100)  # 黑色
     )
+
+    if '--profile' in sys.argv[:-1]:
+        # 任意模式后加 --profile 输出文件(.json 或 .folded)，退出时导出各阶段统计
+        profile_index = sys.argv.index('--profile')
+        profile_path = sys.argv[profile_index + 1]
+        del sys.argv[profile_index:profile_index + 2]
+        atexit.register(detector1.enable_profiling(track_memory=True).dump, profile_path)
     
+    if len(sys.argv) >= 4 and sys.argv[1] == '--batch':
+        # 用法: python "project 2.py" --batch 源目录 输出目录 [进程数]
+        batch_workers = int(sys.argv[4]) if len(sys.argv) > 4 else None
+        detector1.embed_directory(sys.argv[2], sys.argv[3], workers=batch_workers)
+        sys.exit(0)
+
+    if len(sys.argv) >= 4 and sys.argv[1] in ('--matrix', '--matrix-aligned'):
+        # 用法: python "project 2.py" --matrix 图像 矩阵文件(.csv/.json) [进程数]
+        # --matrix-aligned 使用对齐搜索检测
+        matrix_workers = int(sys.argv[4]) if len(sys.argv) > 4 else None
+        for cell in detector1.run_robustness_matrix(sys.argv[2], workers=matrix_workers, matrix_path=sys.argv[3],
+                                                    aligned=sys.argv[1] == '--matrix-aligned'):
+            print(f"{cell['label']:<28} {cell['score']:6.2f}%  "
+                  f"变换{cell['transform_ms']:7.1f}ms  检测{cell['detect_ms']:7.1f}ms")
+        sys.exit(0)
+
+    if len(sys.argv) >= 3 and sys.argv[1] == '--compare':
+        # 用法: python "project 2.py" --compare 图像 [进程数]
+        compare_workers = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+        report = compare_watermark_engines(sys.argv[2], {'text': detector1, 'dct': DCTWatermarkDetector(seed=33333)},
+                                           workers=compare_workers)
+        names = list(report)
+        print(f"{'':<28}" + ''.join(f"{name:>10}" for name in names))
+        for index, cell in enumerate(report[names[0]]['cells']):
+            print(f"{cell['label']:<28}" + ''.join(f"{report[name]['cells'][index]['score']:>9.2f}%" for name in names))
+        for key, title in (('embed_ms', '嵌入耗时(ms)'), ('megapixels_per_s', '嵌入吞吐(MP/s)'),
+                           ('detect_ms', '检测耗时(ms)'), ('mean_score', '平均得分(%)')):
+            print(f"{title:<24}" + ''.join(f"{report[name][key]:>10.2f}" for name in names))
+        sys.exit(0)
+
     # 测试图像路径
     test_image = "test_image.jpg"
     
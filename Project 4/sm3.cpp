@@ -6,7 +6,8 @@
 #define SM3_T2 0x7a879d8a
 
 // 循环左移
-#define ROTL32(x, n) (((x) << (n)) | ((x) >> (32 - (n))))
+// 移位量对32取模，n为0时不会出现移位32位的未定义行为
+#define ROTL32(x, n) (((x) << ((n) & 31)) | ((x) >> ((32 - (n)) & 31)))
 
 // 布尔函数
 #define FF0(x, y, z) ((x) ^ (y) ^ (z))
@@ -161,24 +162,32 @@ void sm3_hash(const uint8_t *data, size_t length, uint8_t digest[32]) {
     sm3_final(&ctx, digest);
 }
 
-// T-table 优化版本
+// 批量哈希
+void sm3_hash_batch(const uint8_t *data, const size_t *lengths, size_t count, uint8_t *digests) {
+    for (size_t i = 0; i < count; i++) {
+        sm3_hash(data, lengths[i], digests + 32 * i);
+        data += lengths[i];
+    }
+}
+
+// T-table 优化版本：T_table[j] = T_j <<< (j mod 32)
 static const uint32_t T_table[64] = {
     0x79cc4519, 0xf3988a32, 0xe7311465, 0xce6228cb,
     0x9cc45197, 0x3988a32f, 0x7311465e, 0xe6228cbc,
     0xcc451979, 0x988a32f3, 0x311465e7, 0x6228cbce,
     0xc451979c, 0x88a32f39, 0x11465e73, 0x228cbce6,
-    0x7a879d8a, 0xf4c1d957, 0xe983b2ae, 0xd30664c5,
-    0xa879d8a7, 0x4c1d957f, 0x983b2aed, 0x30664c5d,
-    0x879d8a7a, 0xc1d957f4, 0x83b2aed9, 0x0664c5d3,
-    0x79d8a7a8, 0x1d957f4c, 0x3b2aed98, 0x664c5d30,
-    0x9d8a7a87, 0xd957f4c1, 0xb2aed983, 0x64c5d306,
-    0xd8a7a879, 0x957f4c1d, 0x2aed983b, 0x4c5d3066,
-    0x8a7a879d, 0x57f4c1d9, 0xaed983b2, 0xc5d30664,
-    0xa7a879d8, 0x7f4c1d95, 0xed983b2a, 0x5d30664c,
-    0x7a879d8a, 0xf4c1d957, 0xe983b2ae, 0xd30664c5,
-    0xa879d8a7, 0x4c1d957f, 0x983b2aed, 0x30664c5d,
-    0x879d8a7a, 0xc1d957f4, 0x83b2aed9, 0x0664c5d3,
-    0x79d8a7a8, 0x1d957f4c, 0x3b2aed98, 0x664c5d30
+    0x9d8a7a87, 0x3b14f50f, 0x7629ea1e, 0xec53d43c,
+    0xd8a7a879, 0xb14f50f3, 0x629ea1e7, 0xc53d43ce,
+    0x8a7a879d, 0x14f50f3b, 0x29ea1e76, 0x53d43cec,
+    0xa7a879d8, 0x4f50f3b1, 0x9ea1e762, 0x3d43cec5,
+    0x7a879d8a, 0xf50f3b14, 0xea1e7629, 0xd43cec53,
+    0xa879d8a7, 0x50f3b14f, 0xa1e7629e, 0x43cec53d,
+    0x879d8a7a, 0x0f3b14f5, 0x1e7629ea, 0x3cec53d4,
+    0x79d8a7a8, 0xf3b14f50, 0xe7629ea1, 0xcec53d43,
+    0x9d8a7a87, 0x3b14f50f, 0x7629ea1e, 0xec53d43c,
+    0xd8a7a879, 0xb14f50f3, 0x629ea1e7, 0xc53d43ce,
+    0x8a7a879d, 0x14f50f3b, 0x29ea1e76, 0x53d43cec,
+    0xa7a879d8, 0x4f50f3b1, 0x9ea1e762, 0x3d43cec5
 };
 
 // 使用 T-table 优化的压缩函数
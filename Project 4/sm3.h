@@ -14,11 +14,21 @@ typedef struct {
     uint8_t buffer[64];      // 消息缓冲区（64字节块）
 } SM3_CTX;
 
-// 函数声明
+#ifdef __cplusplus
+extern "C" {
+#endif
+
+// 函数声明（C链接，便于从Python通过ctypes加载）
 void sm3_init(SM3_CTX *ctx);
 void sm3_update(SM3_CTX *ctx, const uint8_t *data, size_t length);
 void sm3_final(SM3_CTX *ctx, uint8_t digest[32]);
 void sm3_hash(const uint8_t *data, size_t length, uint8_t digest[32]);
 void sm3_hash_optimized1(const uint8_t *data, size_t length, uint8_t digest[32]);
+// 批量哈希：data为count条消息依次拼接，lengths[i]为第i条的长度，digests依次写出count个32字节结果
+void sm3_hash_batch(const uint8_t *data, const size_t *lengths, size_t count, uint8_t *digests);
+
+#ifdef __cplusplus
+}
+#endif
 
 #endif
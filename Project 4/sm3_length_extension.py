@@ -1,7 +1,20 @@
+import struct
 import sys
+import time
+
+try:
+    import numpy as np
+except ImportError:  # 没有NumPy时hash_many逐条计算
+    np = None
 
 class SM3:
-    """SM3哈希算法实现"""
+    """SM3哈希算法实现
+
+    静态方法SM3.hash一次性计算哈希；实例是与hashlib接口一致的增量哈希对象：
+    update分段输入数据，最多缓存一个64字节分组，满一组即压缩，digest/hexdigest/state_words不影响后续update，
+    copy复制当前状态，便于共享前缀的多条消息只计算一次前缀。
+    构造时可传入8个字的链接状态和已处理的字节数，从任意分组边界继续计算（链式哈希、长度扩展）。
+    """
     # 初始向量
     IV = [
         0x7380166F, 0x4914B2B9, 0x172442D7, 0xDA8A0600,
@@ -10,6 +23,71 @@ class SM3:
     
     # 常量T
     T = [0x79CC4519] * 16 + [0x7A879D8A] * 48
+    # 每轮使用的 T_j <<< (j mod 32)，预先算好
+    T_ROTATED = [((t << (j % 32)) | (t >> (32 - j % 32))) & 0xFFFFFFFF for j, t in enumerate(T)]
+
+    name = 'sm3'
+    digest_size = 32
+    block_size = 64
+    # hash_many中同一分组数的消息少于此数时逐条计算，NumPy的固定开销不划算
+    HASH_MANY_MIN_LANES = 8
+
+    def __init__(self, data=b'', state=None, length=0):
+        """state为8个32位字的链接状态（默认IV），length为该状态已处理的字节数，必须是64的整数倍"""
+        if state is None:
+            if length:
+                raise ValueError("指定已处理长度时必须同时给出链接状态")
+            state = SM3.IV
+        if len(state) != 8:
+            raise ValueError("链接状态必须为8个32位字")
+        if length % 64:
+            raise ValueError("链接状态对应的已处理长度必须是64字节的整数倍")
+        self._state = [x & 0xFFFFFFFF for x in state]
+        self._buffer = b''
+        self._length = length  # 已输入的总字节数
+        if data:
+            self.update(data)
+
+    def update(self, data):
+        """追加数据，凑满的64字节分组立即压缩"""
+        data = memoryview(data).cast('B')
+        self._length += len(data)
+        offset = 0
+        if self._buffer:
+            offset = 64 - len(self._buffer)
+            self._buffer += bytes(data[:offset])
+            if len(self._buffer) < 64:
+                return
+            self._state = SM3.compression_function(self._state, self._buffer)
+        state = self._state
+        end = offset + (len(data) - offset) // 64 * 64
+        for i in range(offset, end, 64):
+            state = SM3.compression_function(state, bytes(data[i:i + 64]))
+        self._state = state
+        self._buffer = bytes(data[end:])
+
+    def state_words(self):
+        """返回哈希值对应的8个32位字，可直接作为state传给SM3(...)继续计算，不改变对象状态"""
+        state = self._state
+        tail = SM3.padding(self._buffer, self._length * 8)
+        for i in range(0, len(tail), 64):
+            state = SM3.compression_function(state, tail[i:i + 64])
+        return state
+
+    def digest(self):
+        """返回32字节哈希值，不改变对象状态"""
+        return _pack_words(*self.state_words())
+
+    def hexdigest(self):
+        return self.digest().hex()
+
+    def copy(self):
+        """复制当前状态，副本与原对象此后互不影响"""
+        other = SM3.__new__(SM3)
+        other._state = self._state.copy()
+        other._buffer = self._buffer
+        other._length = self._length
+        return other
     
     @staticmethod
     def rotate_left(x, n):
@@ -83,7 +161,62 @@ class SM3:
     
     @staticmethod
     def compression_function(V, B):
-        """压缩函数"""
+        """压缩函数（快速实现，结果与compression_function_basic相同）
+
+        一次struct.unpack取出16个字，预计算的T_j <<< j，0-15轮与16-63轮分开循环并内联布尔函数、
+        置换函数和循环移位，全部使用局部变量。
+        """
+        if len(B) != 64:
+            raise ValueError("消息分组必须为64字节")
+        W = list(_unpack_block(B))
+        for j in range(16, 68):
+            x = W[j - 16] ^ W[j - 9]
+            y = W[j - 3]
+            x ^= ((y << 15) | (y >> 17)) & 0xFFFFFFFF
+            y = W[j - 13]
+            W.append(x ^ (((x << 15) | (x >> 17)) & 0xFFFFFFFF) ^ (((x << 23) | (x >> 9)) & 0xFFFFFFFF)
+                     ^ (((y << 7) | (y >> 25)) & 0xFFFFFFFF) ^ W[j - 6])
+
+        T = SM3.T_ROTATED
+        A, B_reg, C, D, E, F, G, H = V
+        for j in range(16):
+            a12 = ((A << 12) | (A >> 20)) & 0xFFFFFFFF
+            SS1 = (a12 + E + T[j]) & 0xFFFFFFFF
+            SS1 = ((SS1 << 7) | (SS1 >> 25)) & 0xFFFFFFFF
+            w = W[j]
+            TT1 = ((A ^ B_reg ^ C) + D + (SS1 ^ a12) + (w ^ W[j + 4])) & 0xFFFFFFFF
+            TT2 = ((E ^ F ^ G) + H + SS1 + w) & 0xFFFFFFFF
+            D = C
+            C = ((B_reg << 9) | (B_reg >> 23)) & 0xFFFFFFFF
+            B_reg = A
+            A = TT1
+            H = G
+            G = ((F << 19) | (F >> 13)) & 0xFFFFFFFF
+            F = E
+            E = TT2 ^ (((TT2 << 9) | (TT2 >> 23)) & 0xFFFFFFFF) ^ (((TT2 << 17) | (TT2 >> 15)) & 0xFFFFFFFF)
+        for j in range(16, 64):
+            a12 = ((A << 12) | (A >> 20)) & 0xFFFFFFFF
+            SS1 = (a12 + E + T[j]) & 0xFFFFFFFF
+            SS1 = ((SS1 << 7) | (SS1 >> 25)) & 0xFFFFFFFF
+            w = W[j]
+            # FF_j为多数函数，GG_j写成G ^ (E & (F ^ G))避免对负数取反
+            TT1 = (((A & B_reg) | (C & (A | B_reg))) + D + (SS1 ^ a12) + (w ^ W[j + 4])) & 0xFFFFFFFF
+            TT2 = ((G ^ (E & (F ^ G))) + H + SS1 + w) & 0xFFFFFFFF
+            D = C
+            C = ((B_reg << 9) | (B_reg >> 23)) & 0xFFFFFFFF
+            B_reg = A
+            A = TT1
+            H = G
+            G = ((F << 19) | (F >> 13)) & 0xFFFFFFFF
+            F = E
+            E = TT2 ^ (((TT2 << 9) | (TT2 >> 23)) & 0xFFFFFFFF) ^ (((TT2 << 17) | (TT2 >> 15)) & 0xFFFFFFFF)
+
+        # 与初始状态异或
+        return [A ^ V[0], B_reg ^ V[1], C ^ V[2], D ^ V[3], E ^ V[4], F ^ V[5], G ^ V[6], H ^ V[7]]
+
+    @staticmethod
+    def compression_function_basic(V, B):
+        """压缩函数（按标准逐步实现的参考版本）"""
         A, B_reg, C, D, E, F, G, H = V
         W, W_prime = SM3.message_extension(B)
         
@@ -127,6 +260,116 @@ class SM3:
         # 转换为十六进制字符串
         return ''.join(f'{x:08x}' for x in V)
 
+    @staticmethod
+    def hash_many(messages):
+        """批量计算多条消息的SM3哈希，返回与逐条SM3.hash相同的十六进制字符串列表"""
+        return [digest.hex() for digest in SM3.digest_many(messages)]
+
+    @staticmethod
+    def digest_many(messages):
+        """批量计算多条消息的SM3哈希，返回32字节哈希值列表（与逐条SM3(message).digest()相同）
+
+        消息按填充后的分组数归组，同组消息作为NumPy uint32数组的各条通道，
+        消息扩展和64轮压缩对整组一次完成。没有NumPy时逐条计算。
+        构建Merkle树等需要把哈希值再次输入哈希的场景应使用本方法，避免经十六进制字符串中转。
+        """
+        messages = [bytes(message) for message in messages]
+        results = [None] * len(messages)
+        groups = {}
+        for index, message in enumerate(messages):
+            groups.setdefault((len(message) + 72) // 64, []).append(index)
+
+        for block_count, indices in groups.items():
+            if np is None or len(indices) < SM3.HASH_MANY_MIN_LANES:
+                for index in indices:
+                    results[index] = SM3(messages[index]).digest()
+                continue
+            padded = b''.join(SM3.padding(messages[index]) for index in indices)
+            # (分组, 字, 通道)：每个字是一行，行内是各条消息
+            words = np.frombuffer(padded, dtype='>u4').reshape(len(indices), block_count, 16)
+            words = words.astype(np.uint32).transpose(1, 2, 0).copy()
+            state = [np.full(len(indices), x, dtype=np.uint32) for x in SM3.IV]
+            for block in words:
+                state = _compress_lanes(state, block)
+            digests = np.stack(state, axis=1).astype('>u4').tobytes()
+            for lane, index in enumerate(indices):
+                results[index] = digests[lane * 32:(lane + 1) * 32]
+        return results
+
+
+# 把64字节分组解析为16个大端32位字
+_unpack_block = struct.Struct('>16I').unpack
+# 8个32位字与32字节哈希值互相转换
+_pack_words = struct.Struct('>8I').pack
+_unpack_words = struct.Struct('>8I').unpack
+
+
+# NumPy通道版本使用的T_j <<< j
+_T_ROTATED_LANES = [np.uint32(t) for t in SM3.T_ROTATED] if np is not None else None
+
+
+def _rotl_lanes(x, n):
+    return (x << np.uint32(n)) | (x >> np.uint32(32 - n))
+
+
+def _compress_lanes(V, words):
+    """对多条消息的一个分组同时做压缩，V为8个uint32通道数组，words为16个通道数组"""
+    W = list(words)
+    for j in range(16, 68):
+        x = W[j - 16] ^ W[j - 9] ^ _rotl_lanes(W[j - 3], 15)
+        W.append(x ^ _rotl_lanes(x, 15) ^ _rotl_lanes(x, 23) ^ _rotl_lanes(W[j - 13], 7) ^ W[j - 6])
+
+    T = _T_ROTATED_LANES
+    A, B, C, D, E, F, G, H = V
+    for j in range(64):
+        a12 = _rotl_lanes(A, 12)
+        SS1 = _rotl_lanes(a12 + E + T[j], 7)
+        if j < 16:
+            ff = A ^ B ^ C
+            gg = E ^ F ^ G
+        else:
+            ff = (A & B) | (C & (A | B))
+            gg = G ^ (E & (F ^ G))
+        TT1 = ff + D + (SS1 ^ a12) + (W[j] ^ W[j + 4])
+        TT2 = gg + H + SS1 + W[j]
+        D, C, B, A = C, _rotl_lanes(B, 9), A, TT1
+        H, G, F, E = G, _rotl_lanes(F, 19), E, TT2 ^ _rotl_lanes(TT2, 9) ^ _rotl_lanes(TT2, 17)
+    return [A ^ V[0], B ^ V[1], C ^ V[2], D ^ V[3], E ^ V[4], F ^ V[5], G ^ V[6], H ^ V[7]]
+
+
+def benchmark_hash_many(count=10000, length=32):
+    """比较hash_many与逐条SM3.hash的吞吐量（条/秒）"""
+    messages = [bytes((i * 7 + j) & 0xFF for j in range(length)) for i in range(count)]
+    start = time.perf_counter()
+    SM3.hash_many(messages)
+    batch = count / (time.perf_counter() - start)
+    sample = messages[:max(1, count // 10)]
+    start = time.perf_counter()
+    for message in sample:
+        SM3.hash(message)
+    scalar = len(sample) / (time.perf_counter() - start)
+    print(f"逐条: {scalar:10.0f} 条/秒  hash_many: {batch:10.0f} 条/秒  加速比: {batch / scalar:.1f}x")
+    return {'scalar': scalar, 'batch': batch}
+
+
+def benchmark_compression(size=64 * 1024, repeat=3):
+    """比较参考实现与快速实现的压缩函数吞吐量，返回{实现名: MB/s}"""
+    blocks = [bytes((i * 31 + j) & 0xFF for j in range(64)) for i in range(size // 64)]
+    results = {}
+    for name, compress in (('basic', SM3.compression_function_basic), ('fast', SM3.compression_function)):
+        best = None
+        for _ in range(repeat):
+            state = SM3.IV
+            start = time.perf_counter()
+            for block in blocks:
+                state = compress(state, block)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = len(blocks) * 64 / best / (1024 * 1024)
+        print(f"{name:<6} {results[name]:8.3f} MB/s")
+    print(f"加速比: {results['fast'] / results['basic']:.2f}x")
+    return results
+
 
 class LengthExtensionAttacker:
     """SM3长度扩展攻击实现"""
@@ -135,28 +378,28 @@ class LengthExtensionAttacker:
     def attack(original_hash, original_length, append_data):
         """
         执行长度扩展攻击
-        original_hash: 原始消息的哈希值
+        original_hash: 原始消息的哈希值（8个32位字、32字节或十六进制字符串）
         original_length: 原始消息的长度（字节）
         append_data: 要附加的数据
-        返回: 扩展消息的哈希值
+        返回: 扩展消息的哈希值（十六进制字符串）
         """
-        # 将原始哈希转换为初始向量
-        hash_bytes = bytes.fromhex(original_hash)
-        initial_vector = [
-            int.from_bytes(hash_bytes[i*4:(i+1)*4], byteorder='big')
-            for i in range(8)
-        ]
+        return LengthExtensionAttacker.forge(original_hash, original_length, append_data).hexdigest()
+
+    @staticmethod
+    def forge(original_hash, original_length, append_data):
+        """执行长度扩展攻击，返回已输入附加数据的SM3对象，可按需取digest/hexdigest/state_words"""
+        # 将原始哈希转换为链接状态，字列表直接使用
+        if isinstance(original_hash, str):
+            original_hash = bytes.fromhex(original_hash)
+        if isinstance(original_hash, (bytes, bytearray)):
+            original_hash = _unpack_words(original_hash)
         
         # 计算原始消息填充后的长度
         padding_length = (64 - (original_length + 9) % 64) % 64
         original_padded_length = original_length + 1 + padding_length + 8
         
-        # 计算扩展后的总长度（比特）
-        total_length = original_padded_length + len(append_data)
-        total_bit_length = total_length * 8
-        
-        # 计算扩展消息的哈希
-        return SM3.hash(append_data, initial_vector, total_bit_length)
+        # 从原始哈希对应的状态继续计算扩展消息的哈希
+        return SM3(append_data, state=original_hash, length=original_padded_length)
 
 
 def verify_attack():
@@ -166,9 +409,9 @@ def verify_attack():
     print(f"原始消息: {original_message.decode()}")
     
     # 计算原始消息的哈希和长度（攻击者已知的信息）
-    original_hash = SM3.hash(original_message)
+    original_hash = SM3(original_message).state_words()
     original_length = len(original_message)
-    print(f"原始哈希值: {original_hash}")
+    print(f"原始哈希值: {''.join(f'{x:08x}' for x in original_hash)}")
     print(f"原始消息长度: {original_length}字节")
     
     # 攻击者要附加的数据
@@ -177,14 +420,14 @@ def verify_attack():
     
     # 执行攻击
     attacker = LengthExtensionAttacker()
-    attack_hash = attacker.attack(original_hash, original_length, append_data)
-    print(f"攻击生成的哈希: {attack_hash}")
+    attack_hash = attacker.forge(original_hash, original_length, append_data).digest()
+    print(f"攻击生成的哈希: {attack_hash.hex()}")
     
     # 计算实际扩展消息的哈希（用于验证）
     padded_original = SM3.padding(original_message)
     full_extended = padded_original + append_data
-    actual_hash = SM3.hash(full_extended)
-    print(f"实际扩展消息哈希: {actual_hash}")
+    actual_hash = SM3(full_extended).digest()
+    print(f"实际扩展消息哈希: {actual_hash.hex()}")
     
     # 验证结果
     if attack_hash == actual_hash:
@@ -194,4 +437,10 @@ def verify_attack():
 
 
 if __name__ == "__main__":
-    verify_attack()
+    if len(sys.argv) > 1 and sys.argv[1] == '--bench':
+        # 用法: python sm3_length_extension.py --bench [KB]
+        benchmark_compression(int(sys.argv[2]) * 1024 if len(sys.argv) > 2 else 64 * 1024)
+        if np is not None:
+            benchmark_hash_many()
+    else:
+        verify_attack()
@@ -0,0 +1,212 @@
+"""SM3原生加速：通过ctypes加载由sm3.cpp编译的共享库，不可用时回退到纯Python实现
+
+编译共享库（生成在本文件所在目录）：
+    python sm3_native.py --build
+    等价于 g++ -O2 -shared -fPIC sm3.cpp -o libsm3.so（Windows下为sm3.dll，macOS下为libsm3.dylib）
+也可以用环境变量SM3_LIBRARY指定共享库路径。
+
+ctypes调用外部函数期间会释放GIL，因此digest_many/hash_many在多个线程中并发调用时可以真正并行，
+digest_many_parallel/hash_many_parallel即按此把一批消息分给多个线程。
+digest、digest_many系列返回32字节哈希值，hash系列返回十六进制字符串。
+"""
+import ctypes
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sm3_length_extension import SM3, _unpack_words
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+LIBRARY_NAME = {'win32': 'sm3.dll', 'darwin': 'libsm3.dylib'}.get(sys.platform, 'libsm3.so')
+
+
+class _SM3Context(ctypes.Structure):
+    """与sm3.h中SM3_CTX的布局一致"""
+    _fields_ = [
+        ('state', ctypes.c_uint32 * 8),
+        ('totalLength', ctypes.c_uint64),
+        ('bufferLength', ctypes.c_size_t),
+        ('buffer', ctypes.c_uint8 * 64),
+    ]
+
+
+def _load_library(path=None):
+    """依次尝试path、环境变量SM3_LIBRARY和本目录下的共享库，都不可用时返回None"""
+    for candidate in (path, os.environ.get('SM3_LIBRARY'), os.path.join(_HERE, LIBRARY_NAME)):
+        if not candidate or not os.path.exists(candidate):
+            continue
+        try:
+            lib = ctypes.CDLL(candidate)
+        except OSError:
+            continue
+        context = ctypes.POINTER(_SM3Context)
+        lib.sm3_init.argtypes = [context]
+        lib.sm3_init.restype = None
+        lib.sm3_update.argtypes = [context, ctypes.c_char_p, ctypes.c_size_t]
+        lib.sm3_update.restype = None
+        lib.sm3_final.argtypes = [context, ctypes.c_char_p]
+        lib.sm3_final.restype = None
+        lib.sm3_hash.argtypes = [ctypes.c_char_p, ctypes.c_size_t, ctypes.c_char_p]
+        lib.sm3_hash.restype = None
+        lib.sm3_hash_batch.argtypes = [ctypes.c_char_p, ctypes.POINTER(ctypes.c_size_t),
+                                       ctypes.c_size_t, ctypes.c_char_p]
+        lib.sm3_hash_batch.restype = None
+        return lib
+    return None
+
+
+def build_library(output=None, compiler=None):
+    """用C++编译器把sm3.cpp编译为共享库，返回生成的路径"""
+    output = output or os.path.join(_HERE, LIBRARY_NAME)
+    compiler = compiler or os.environ.get('CXX', 'g++')
+    subprocess.run([compiler, '-O2', '-shared', '-fPIC', os.path.join(_HERE, 'sm3.cpp'), '-o', output],
+                   check=True)
+    return output
+
+
+_lib = _load_library()
+# 是否加载到了原生库
+AVAILABLE = _lib is not None
+
+
+def _as_bytes(data):
+    return data if isinstance(data, bytes) else bytes(data)
+
+
+class NativeSM3:
+    """原生库实现的增量哈希对象，接口与SM3实例（hashlib风格）一致"""
+    name = 'sm3'
+    digest_size = 32
+    block_size = 64
+
+    def __init__(self, data=b'', state=None, length=0):
+        """state、length的含义与SM3(...)相同：链接状态及其已处理的字节数"""
+        if _lib is None:
+            raise RuntimeError("未加载SM3原生库")
+        self._ctx = _SM3Context()
+        _lib.sm3_init(ctypes.byref(self._ctx))
+        if state is not None:
+            if len(state) != 8:
+                raise ValueError("链接状态必须为8个32位字")
+            if length % 64:
+                raise ValueError("链接状态对应的已处理长度必须是64字节的整数倍")
+            self._ctx.state[:] = [x & 0xFFFFFFFF for x in state]
+            self._ctx.totalLength = length * 8
+        elif length:
+            raise ValueError("指定已处理长度时必须同时给出链接状态")
+        if data:
+            self.update(data)
+
+    def update(self, data):
+        data = _as_bytes(data)
+        _lib.sm3_update(ctypes.byref(self._ctx), data, len(data))
+
+    def digest(self):
+        """返回32字节哈希值，在上下文副本上完成填充，不改变对象状态"""
+        ctx = _SM3Context.from_buffer_copy(self._ctx)
+        digest = ctypes.create_string_buffer(32)
+        _lib.sm3_final(ctypes.byref(ctx), digest)
+        return digest.raw
+
+    def hexdigest(self):
+        return self.digest().hex()
+
+    def state_words(self):
+        """返回哈希值对应的8个32位字"""
+        return list(_unpack_words(self.digest()))
+
+    def copy(self):
+        other = NativeSM3.__new__(NativeSM3)
+        other._ctx = _SM3Context.from_buffer_copy(self._ctx)
+        return other
+
+
+def new(data=b'', state=None, length=0):
+    """返回增量哈希对象：原生库可用时为NativeSM3，否则为纯Python的SM3"""
+    return NativeSM3(data, state, length) if _lib is not None else SM3(data, state, length)
+
+
+def digest(message):
+    """计算SM3哈希，返回32字节哈希值"""
+    if _lib is None:
+        return SM3(message).digest()
+    message = _as_bytes(message)
+    digest = ctypes.create_string_buffer(32)
+    _lib.sm3_hash(message, len(message), digest)
+    return digest.raw
+
+
+def hash(message):
+    """计算SM3哈希，返回十六进制字符串（与SM3.hash相同）"""
+    return digest(message).hex()
+
+
+def digest_many(messages):
+    """批量计算SM3哈希，返回32字节哈希值列表
+
+    原生库可用时所有消息拼接后一次调用sm3_hash_batch，调用期间释放GIL；否则使用SM3.digest_many。
+    """
+    if _lib is None:
+        return SM3.digest_many(messages)
+    messages = [_as_bytes(message) for message in messages]
+    if not messages:
+        return []
+    lengths = (ctypes.c_size_t * len(messages))(*map(len, messages))
+    digests = ctypes.create_string_buffer(32 * len(messages))
+    _lib.sm3_hash_batch(b''.join(messages), lengths, len(messages), digests)
+    raw = digests.raw
+    return [raw[i:i + 32] for i in range(0, len(raw), 32)]
+
+
+def hash_many(messages):
+    """批量计算SM3哈希，返回十六进制字符串列表"""
+    return [digest.hex() for digest in digest_many(messages)]
+
+
+def digest_many_parallel(messages, threads=None):
+    """把消息分成若干段由多个线程分别调用digest_many，返回32字节哈希值列表，顺序与输入一致"""
+    messages = list(messages)
+    threads = threads or os.cpu_count() or 1
+    if threads == 1 or len(messages) < 2 * threads:
+        return digest_many(messages)
+    chunk = (len(messages) + threads - 1) // threads
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        parts = executor.map(digest_many, [messages[i:i + chunk] for i in range(0, len(messages), chunk)])
+    return [digest for part in parts for digest in part]
+
+
+def hash_many_parallel(messages, threads=None):
+    """digest_many_parallel的十六进制字符串版本"""
+    return [digest.hex() for digest in digest_many_parallel(messages, threads)]
+
+
+def benchmark(count=20000, length=64, threads=None):
+    """比较纯Python、NumPy批量、原生批量和原生多线程批量的吞吐量（条/秒）"""
+    messages = [bytes((i * 13 + j) & 0xFF for j in range(length)) for i in range(count)]
+    cases = [('python', lambda batch: [SM3.hash(message) for message in batch], count // 20),
+             ('python_hash_many', SM3.hash_many, count)]
+    if AVAILABLE:
+        cases += [('native_hash_many', hash_many, count),
+                  ('native_parallel', lambda batch: hash_many_parallel(batch, threads), count)]
+    results = {}
+    for name, func, size in cases:
+        start = time.perf_counter()
+        func(messages[:size])
+        results[name] = size / (time.perf_counter() - start)
+        print(f"{name:<18} {results[name]:12.0f} 条/秒")
+    return results
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == '--build':
+        print(f"已生成 {build_library()}")
+    elif len(sys.argv) > 1 and sys.argv[1] == '--bench':
+        benchmark()
+    else:
+        print(f"原生库{'已加载' if AVAILABLE else '不可用，使用纯Python实现'}")
+        print(f"SM3(\"abc\") = {hash(b'abc')}")
+        h = new(b'a')
+        h.update(b'bc')
+        print(f"增量计算结果一致: {h.hexdigest() == SM3.hash(b'abc')}")